@@ -0,0 +1,117 @@
+'''
+    Throughput and peak memory of a training step (forward + backward) of a
+    random Llama model for every activation checkpointing policy, next to
+    the estimate ActivationCheckpointing uses for the budget policy.
+
+    On GPU peak memory is torch.cuda.max_memory_allocated above the memory
+    held before the step. On CPU it is the peak anonymous RSS above the one
+    before the step, sampled while stepping, so it is coarser. Both include
+    the logits and the loss, which the estimate (decoder layers only)
+    leaves out.
+
+        python benchmarks/activation_checkpointing.py --hidden_size 1024 --num_layers 8
+        python benchmarks/activation_checkpointing.py --policies none all every_2 every_4 --seq_len 4096
+'''
+import time
+import argparse
+
+from checkpoint_loading import PeakMemory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden_size", type=int, default=512)
+    parser.add_argument("--num_layers", type=int, default=8)
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--seq_len", type=int, default=1024)
+    parser.add_argument("--dtype", choices=["float32", "bfloat16"], default="float32")
+    parser.add_argument("--policies", nargs="+", default=["none", "every_4", "every_2", "all", "budget"])
+    parser.add_argument("--budget", type=float, default=None,
+                        help="GiB for the budget policy, by default half of the estimate without checkpointing")
+    parser.add_argument("--steps", type=int, default=3)
+    args = parser.parse_args()
+
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+    from higgsfield.models.causal_lm import get_device, decoder_layer_classes
+    from higgsfield.models.activation_checkpointing import (
+        ActivationCheckpointing,
+        activation_bytes_per_token,
+        apply_selective_checkpointing,
+    )
+
+    device = get_device()
+    dtype  = getattr(torch, args.dtype)
+    tokens = args.batch_size * args.seq_len
+
+    config = LlamaConfig(
+        hidden_size=args.hidden_size,
+        intermediate_size=args.hidden_size * 8 // 3 // 64 * 64,
+        num_hidden_layers=args.num_layers,
+        num_attention_heads=args.hidden_size // 64,
+        vocab_size=32000,
+        use_cache=False,
+    )
+
+    bytes_per_token       = activation_bytes_per_token(config, dtype)
+    input_bytes_per_token = config.hidden_size * torch.tensor([], dtype=dtype).element_size()
+
+    budget = args.budget or bytes_per_token * tokens * args.num_layers / 2 / 2**30
+
+    print(f"{args.num_layers} layers, hidden size {args.hidden_size}, {tokens} tokens of {args.dtype} on {device}\n")
+    print(f"{'policy':10} {'recomputed':>10} {'tokens/s':>9} {'peak MiB':>9} {'estimate MiB':>13}")
+
+    for policy in args.policies:
+        torch.manual_seed(0)
+        model = LlamaForCausalLM(config).to(device=device, dtype=dtype)
+
+        checkpointing = ActivationCheckpointing(
+            policy,
+            num_layers=args.num_layers,
+            bytes_per_token=bytes_per_token,
+            input_bytes_per_token=input_bytes_per_token,
+            memory_budget=budget,
+        )
+        apply_selective_checkpointing(model, decoder_layer_classes(model), checkpointing)
+
+        input_ids = torch.randint(0, config.vocab_size, (args.batch_size, args.seq_len), device=device)
+
+        def step():
+            checkpointing.set_tokens(input_ids.numel())
+            model(input_ids=input_ids, labels=input_ids).loss.backward()
+            model.zero_grad(set_to_none=True)
+
+        # warmup, allocates the gradients once
+        step()
+
+        seconds, peaks = [], []
+        for _ in range(args.steps):
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats()
+                start = torch.cuda.memory_allocated()
+            else:
+                memory = PeakMemory()
+                memory.start()
+
+            t0 = time.perf_counter()
+            step()
+
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+                peaks.append((torch.cuda.max_memory_allocated() - start) / 2**20)
+            else:
+                peaks.append(memory.stop()[0])
+
+            seconds.append(time.perf_counter() - t0)
+
+        estimate = checkpointing.activation_bytes(tokens) / 2**20
+        print(
+            f"{policy:10} {checkpointing.num_checkpointed():>4}/{args.num_layers:<5} "
+            f"{tokens / min(seconds):9.0f} {max(peaks):9.0f} {estimate:13.0f}"
+        )
+
+        del model
+
+if __name__ == "__main__":
+    main()
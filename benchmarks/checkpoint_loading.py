@@ -0,0 +1,132 @@
+'''
+    Compares startup time and peak RSS of building a Llama model from a
+    rank 0 checkpoint on CPU: the former path (random init + torch.load +
+    load_state_dict) against load_llama_from_checkpoint on memory mapped
+    torch.save and safetensors files. Every run uses a fresh interpreter.
+
+    Memory is sampled while loading: heap is anonymous memory (what the
+    process really holds), mapped is file pages of the memory mapped
+    checkpoint, which live in the page cache and can be reclaimed.
+
+        python benchmarks/checkpoint_loading.py --hidden_size 1024 --num_layers 8
+        python benchmarks/checkpoint_loading.py --dtype bfloat16
+'''
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+METHODS = ["init+torch.load", "mmap torch.save", "mmap safetensors"]
+
+def rss_mb():
+    '''
+        (anonymous, file) resident memory of this process in MB.
+    '''
+    rss = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                rss[line.split(":")[0]] = int(line.split()[1]) / 1024
+    return rss.get("RssAnon", 0.0), rss.get("RssFile", 0.0)
+
+class PeakMemory(threading.Thread):
+    def __init__(self, interval=0.002):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_rss = rss_mb()
+        self.peak = self.start_rss
+        self.running = True
+
+    def run(self):
+        while self.running:
+            anon, file = rss_mb()
+            self.peak = (max(self.peak[0], anon), max(self.peak[1], file))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        return tuple(peak - start for peak, start in zip(self.peak, self.start_rss))
+
+def child(method, path, dtype):
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+    from higgsfield.llama.llama_utils import load_llama_from_checkpoint
+
+    dtype = getattr(torch, dtype)
+    memory = PeakMemory()
+    memory.start()
+
+    t0 = time.perf_counter()
+    if method == "init+torch.load":
+        model = LlamaForCausalLM(LlamaConfig.from_pretrained(path))
+        model.load_state_dict(torch.load(Path(path) / "model.pt"))
+        model.to(dtype)
+    elif method == "mmap torch.save":
+        model = load_llama_from_checkpoint(path, Path(path) / "model.pt", dtype=dtype)
+    else:
+        model = load_llama_from_checkpoint(path, Path(path) / "model.safetensors", dtype=dtype)
+
+    # touch every weight once, like the first forward pass would
+    checksum = sum(p.sum(dtype=torch.float32).item() for p in model.parameters())
+    t1 = time.perf_counter()
+
+    heap, mapped = memory.stop()
+    print(f"{t1 - t0:.4f} {heap:.1f} {mapped:.1f} {checksum:.4f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden_size", type=int, default=512)
+    parser.add_argument("--num_layers", type=int, default=8)
+    parser.add_argument("--vocab_size", type=int, default=32000)
+    parser.add_argument("--dtype", choices=["float32", "bfloat16"], default="float32")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+    from higgsfield.checkpoint.mmap_utils import save_safetensors
+
+    with tempfile.TemporaryDirectory() as path:
+        config = LlamaConfig(
+            vocab_size=args.vocab_size,
+            hidden_size=args.hidden_size,
+            intermediate_size=args.hidden_size * 4,
+            num_hidden_layers=args.num_layers,
+            num_attention_heads=max(args.hidden_size // 128, 1),
+        )
+        config.save_pretrained(path)
+
+        state_dict = LlamaForCausalLM(config).to(getattr(torch, args.dtype)).state_dict()
+        torch.save(state_dict, Path(path) / "model.pt")
+        save_safetensors(state_dict, Path(path) / "model.safetensors")
+
+        size = sum(t.numel() * t.element_size() for t in state_dict.values()) / 2**20
+        print(f"checkpoint: {size:.1f} MB of {args.dtype} weights\n")
+        del state_dict
+
+        print(f"{'method':20} {'time s':>8} {'peak heap MB':>13} {'peak mapped MB':>15}")
+        for method in METHODS:
+            runs = []
+            for _ in range(args.repeats):
+                out = subprocess.run(
+                    [sys.executable, __file__, "--child", method, path, args.dtype],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout.split()
+                runs.append((float(out[-4]), float(out[-3]), float(out[-2])))
+
+            seconds, heap, mapped = min(runs)
+            print(f"{method:20} {seconds:8.3f} {heap:13.1f} {mapped:15.1f}")
+
+if __name__ == "__main__":
+    main()
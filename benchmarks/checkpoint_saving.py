@@ -0,0 +1,117 @@
+'''
+    Compares write and read throughput of a synthetic full state dict on
+    CPU: plain torch.save / torch.load of one file, a single safetensors
+    stream, and save_parallel / load_parallel (size balanced .safetensors
+    files written and read by a thread pool).
+
+    Every write includes the fsync. Before every read the files are dropped
+    from the page cache (posix_fadvise DONTNEED), so reads come from the
+    disk unless the kernel ignores the hint.
+
+        python benchmarks/checkpoint_saving.py --size_gb 4 --num_tensors 400
+        python benchmarks/checkpoint_saving.py --dir /mnt/nvme --threads 4 8 16
+'''
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+def make_state_dict(size_gb, num_tensors, dtype):
+    '''
+        Tensors of mixed sizes like the ones of a transformer: a few large
+        embedding sized ones, many layer sized ones and small norms.
+    '''
+    import torch
+
+    element_size = torch.tensor([], dtype=dtype).element_size()
+    total = int(size_gb * 2**30) // element_size
+
+    weights = [8.0] * 2 + [1.0] * (num_tensors - 2)
+    state_dict = {}
+    for i, weight in enumerate(weights):
+        numel = int(total * weight / sum(weights))
+        state_dict[f"layers.{i}.weight"] = torch.randn(numel // 1024, 1024).to(dtype)
+        state_dict[f"layers.{i}.norm"] = torch.ones(1024, dtype=dtype)
+
+    return state_dict
+
+def drop_cache(path):
+    for file in [path] if path.is_file() else path.iterdir():
+        fd = os.open(file, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def measure(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - t0, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size_gb", type=float, default=2.0)
+    parser.add_argument("--num_tensors", type=int, default=200)
+    parser.add_argument("--dtype", choices=["float32", "bfloat16"], default="bfloat16")
+    parser.add_argument("--threads", type=int, nargs="+", default=[4, 8])
+    parser.add_argument("--dir", default=None, help="where to write, by default a temporary directory")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    import torch
+    from higgsfield.checkpoint.fsdp_checkpoint import save_file
+    from higgsfield.checkpoint.mmap_utils import save_safetensors, read_safetensors
+    from higgsfield.checkpoint.parallel_io import save_parallel, load_parallel
+
+    state_dict = make_state_dict(args.size_gb, args.num_tensors, getattr(torch, args.dtype))
+    size = sum(t.numel() * t.element_size() for t in state_dict.values()) / 2**30
+    print(f"state dict: {size:.2f} GiB of {args.dtype} in {len(state_dict)} tensors\n")
+
+    methods = [
+        (
+            "torch.save",
+            "model.pt",
+            lambda path: save_file(state_dict, path),
+            lambda path: torch.load(path, weights_only=True),
+        ),
+        (
+            "safetensors",
+            "model.safetensors",
+            lambda path: save_safetensors(state_dict, path),
+            read_safetensors,
+        ),
+    ]
+    for threads in args.threads:
+        methods.append((
+            f"parallel x{threads}",
+            "model.safetensors.index.json",
+            lambda path, threads=threads: save_parallel(state_dict, path, num_files=threads, num_threads=threads),
+            lambda path, threads=threads: load_parallel(path, num_threads=threads),
+        ))
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        print(f"{'method':16} {'write GB/s':>11} {'read GB/s':>10}")
+        for name, file, save, load in methods:
+            writes, reads = [], []
+            for _ in range(args.repeats):
+                path = Path(root) / name.replace(" ", "_")
+                path.mkdir()
+
+                seconds, _ = measure(lambda: save(path / file))
+                writes.append(seconds)
+
+                drop_cache(path)
+                seconds, loaded = measure(lambda: load(path / file))
+                reads.append(seconds)
+
+                assert all(torch.equal(loaded[key], state_dict[key]) for key in list(state_dict)[:4])
+                del loaded
+                shutil.rmtree(path)
+
+            gb = size * 2**30 / 1e9
+            print(f"{name:16} {gb / min(writes):11.2f} {gb / min(reads):10.2f}")
+
+if __name__ == "__main__":
+    main()
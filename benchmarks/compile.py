@@ -0,0 +1,117 @@
+'''
+    Compile time against steady-state gain of compiling the decoder layers
+    of a random Llama model (compile_decoder_layers), for a training step
+    (forward + backward) with activation checkpointing of every layer.
+
+    Runs the eager model, then the compiled one with an empty cache (cold)
+    and again with the cache the cold run filled (warm, what a restarted
+    run pays). break-even is the number of steps after which the compiled
+    model caught up with the eager one.
+
+        python benchmarks/compile.py --hidden_size 1024 --num_layers 8
+        python benchmarks/compile.py --mode max-autotune-no-cudagraphs
+'''
+import os
+import sys
+import time
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+
+def child(args):
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+    from higgsfield.models.causal_lm import get_device, decoder_layer_classes
+    from higgsfield.models.compilation import compile_decoder_layers
+    from higgsfield.models.activation_checkpointing import (
+        ActivationCheckpointing,
+        apply_selective_checkpointing,
+    )
+
+    device = get_device()
+    config = LlamaConfig(
+        hidden_size=args.hidden_size,
+        intermediate_size=args.hidden_size * 8 // 3 // 64 * 64,
+        num_hidden_layers=args.num_layers,
+        num_attention_heads=args.hidden_size // 64,
+        vocab_size=32000,
+        use_cache=False,
+    )
+
+    torch.manual_seed(0)
+    model = LlamaForCausalLM(config).to(device=device, dtype=getattr(torch, args.dtype))
+
+    layers = decoder_layer_classes(model)
+    apply_selective_checkpointing(model, layers, ActivationCheckpointing("all", args.num_layers, 1, 1))
+
+    if args.compiled:
+        compile_decoder_layers(model, layers, mode=args.mode)
+
+    input_ids = torch.randint(0, config.vocab_size, (args.batch_size, args.seq_len), device=device)
+
+    times = []
+    for _ in range(args.steps):
+        t0 = time.perf_counter()
+        model(input_ids=input_ids, labels=input_ids).loss.backward()
+        model.zero_grad(set_to_none=True)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - t0)
+
+    print(json.dumps({"first": times[0], "steady": statistics.median(times[2:])}))
+
+def run(args, compiled, cache_dir):
+    env = dict(os.environ, TORCHINDUCTOR_CACHE_DIR=cache_dir)
+    argv = [a for a in sys.argv[1:] if a != "--compiled"] + (["--compiled"] if compiled else [])
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", *argv],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden_size", type=int, default=512)
+    parser.add_argument("--num_layers", type=int, default=8)
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--seq_len", type=int, default=512)
+    parser.add_argument("--dtype", choices=["float32", "bfloat16"], default="float32")
+    parser.add_argument("--mode", default=None, help="torch.compile mode")
+    parser.add_argument("--steps", type=int, default=12)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--compiled", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        eager = run(args, False, cache_dir)
+        cold  = run(args, True, cache_dir)
+        warm  = run(args, True, cache_dir)
+
+    print(f"{'':8} {'first step s':>13} {'steady step s':>14} {'compile s':>10} {'break-even':>11}")
+
+    for name, result in [("eager", eager), ("cold", cold), ("warm", warm)]:
+        compile_time = max(result["first"] - eager["first"], 0) if name != "eager" else 0
+        gain = eager["steady"] - result["steady"]
+
+        if name == "eager":
+            break_even = ""
+        elif gain > 0:
+            break_even = f"{compile_time / gain:.0f} steps"
+        else:
+            break_even = "never"
+
+        print(f"{name:8} {result['first']:13.2f} {result['steady']:14.4f} {compile_time:10.1f} {break_even:>11}")
+
+    print(f"\nsteady-state speedup {eager['steady'] / cold['steady']:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+'''
+    Measures the wall-clock time of importing the higgsfield entry points in
+    a fresh interpreter, next to the bare interpreter startup.
+
+        python benchmarks/import_time.py --repeats 5
+'''
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ENTRY_POINTS = [
+    "higgsfield",
+    "higgsfield.experiment",
+    "higgsfield.internal.main",
+    "higgsfield.dataset",
+    "higgsfield.loaders",
+    "higgsfield.mistral.mistral_loader",
+    "higgsfield.training",
+    "higgsfield.checkpoint",
+    "higgsfield.llama",
+    "higgsfield.mistral.mistral",
+]
+
+def import_time(statement, repeats, env):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True, env=env)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # fail fast instead of hanging on the network if anything still
+    # downloads at import time
+    env.setdefault("HF_HUB_OFFLINE", "1")
+
+    baseline = import_time("pass", args.repeats, env)
+    print(f"{'python startup':40} {baseline * 1000:8.1f} ms")
+
+    for module in ENTRY_POINTS:
+        try:
+            seconds = import_time(f"import {module}", args.repeats, env)
+        except subprocess.CalledProcessError:
+            print(f"{module:40} {'failed':>8}")
+            continue
+        print(f"{module:40} {(seconds - baseline) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+'''
+    Checks that encode_completions gives the same input_ids / labels as
+    encoding every prompt and prompt + completion one by one, counts the
+    labels single_pass=True (fast tokenizers only) moves at the prompt /
+    completion boundary, and compares the time to prepare long chats one
+    item per assistant message (ChatCompletionDataset) against one item per
+    chat (ChatMultiTurnDataset).
+
+        python benchmarks/incremental_tokenization.py --tokenizer mistralai/Mistral-7B-v0.1
+'''
+import time
+import argparse
+
+import torch
+from transformers import AutoTokenizer
+
+from higgsfield.dataset import (
+    TorchCompletionDataset,
+    TorchMultiTurnDataset,
+)
+from higgsfield.dataset.openai import (
+    ChatCompletionDataset,
+    ChatMultiTurnDataset,
+)
+
+WORDS = ["Sure", "here", "is", "the", "answer", "GPU", "node", "why", "how",
+         "does", "sharding", "work", "?", ",", ".", "\n", "  ", "ok"]
+
+def sentence(g, n):
+    ids = torch.randint(len(WORDS), (n,), generator=g).tolist()
+    return " ".join(WORDS[i] for i in ids)
+
+def synthetic_chats(num_chats, num_turns, seed=0):
+    g = torch.Generator()
+    g.manual_seed(seed)
+
+    chats = []
+    for _ in range(num_chats):
+        chat = [{"role": "system", "content": sentence(g, 10)}]
+        for _ in range(num_turns):
+            chat.append({"role": "user", "content": sentence(g, 30)})
+            chat.append({"role": "assistant", "content": sentence(g, 60)})
+        chats.append(chat)
+
+    return chats
+
+def reference_labels(tokenizer, item, max_sequence_length):
+    prompt_length = len(tokenizer.encode(item["prompt"]))
+    example = tokenizer.encode(item["prompt"] + item["completion"])
+    example.append(tokenizer.eos_token_id)
+
+    example = torch.tensor(example[:max_sequence_length], dtype=torch.int64)
+    labels = example.clone()
+    labels[: prompt_length] = -100
+
+    return example, labels
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokenizer", default="meta-llama/Llama-2-7b-hf")
+    parser.add_argument("--num_chats", type=int, default=50)
+    parser.add_argument("--num_turns", type=int, default=32)
+    parser.add_argument("--max_sequence_length", type=int, default=1 << 20)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+    chats = synthetic_chats(args.num_chats, args.num_turns)
+
+    per_message = ChatCompletionDataset(chats)
+
+    for single_pass in (False, True):
+        dataset = TorchCompletionDataset(
+            per_message, tokenizer, args.max_sequence_length, single_pass=single_pass,
+        )
+
+        mismatches = 0
+        for idx in range(len(dataset)):
+            example, labels = dataset.tokenize(idx)
+            labels[labels < 0] = -100
+
+            expected_example, expected_labels = reference_labels(
+                tokenizer, per_message[idx], args.max_sequence_length,
+            )
+            mismatches += not (
+                torch.equal(example, expected_example) and torch.equal(labels, expected_labels)
+            )
+        print(f"single_pass={single_pass}: {len(dataset)} completions checked, {mismatches} label mismatches")
+
+        if not single_pass:
+            assert mismatches == 0, "encode_completions differs from the two-call encoding"
+
+    for single_pass in (False, True):
+        dataset = TorchCompletionDataset(
+            per_message, tokenizer, args.max_sequence_length, single_pass=single_pass,
+        )
+        multi_turn = TorchMultiTurnDataset(
+            ChatMultiTurnDataset(chats), tokenizer, args.max_sequence_length, single_pass=single_pass,
+        )
+
+        t0 = time.perf_counter()
+        tokens = sum(len(dataset.tokenize(idx)[0]) for idx in range(len(dataset)))
+        t1 = time.perf_counter()
+        print(f"single_pass={single_pass}, one item per assistant message: {t1 - t0:8.3f}s, {tokens} tokens encoded")
+
+        t0 = time.perf_counter()
+        tokens = sum(len(multi_turn.tokenize(idx)[0]) for idx in range(len(multi_turn)))
+        t1 = time.perf_counter()
+        print(f"single_pass={single_pass}, one item per chat:              {t1 - t0:8.3f}s, {tokens} tokens encoded")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+'''
+    Compares the per-item tokenization path of TorchCompletionDataset with
+    the batched, multi-process path of compile_dataset and checks that both
+    produce the same input_ids / labels.
+
+        python benchmarks/tokenization.py --tokenizer meta-llama/Llama-2-7b-hf --num_proc 8
+'''
+import time
+import argparse
+import tempfile
+
+import torch
+from transformers import AutoTokenizer
+
+from higgsfield.dataset import (
+    CompletionDataset,
+    TorchCompletionDataset,
+    TorchMMapDataset,
+    compile_dataset,
+)
+
+class SyntheticAlpaca(CompletionDataset):
+    def __init__(self, num_samples, seed=0):
+        g = torch.Generator()
+        g.manual_seed(seed)
+
+        words = ["instruction", "response", "model", "the", "a", "describe",
+                 "write", "short", "story", "about", "GPU", "training", "data"]
+
+        def sentence(n):
+            ids = torch.randint(len(words), (n,), generator=g).tolist()
+            return " ".join(words[i] for i in ids)
+
+        self.items = []
+        for _ in range(num_samples):
+            lengths = torch.randint(8, 200, (2,), generator=g).tolist()
+            self.items.append({
+                "prompt": f"### Instruction:\n{sentence(lengths[0])}\n\n### Response:",
+                "completion": " " + sentence(lengths[1]),
+            })
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        return self.items[idx]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokenizer", default="meta-llama/Llama-2-7b-hf")
+    parser.add_argument("--num_samples", type=int, default=20000)
+    parser.add_argument("--max_sequence_length", type=int, default=2048)
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--num_proc", type=int, default=8)
+    args = parser.parse_args()
+
+    dataset = SyntheticAlpaca(args.num_samples)
+
+    slow = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=False)
+    fast = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+
+    reference = TorchCompletionDataset(dataset, slow, args.max_sequence_length)
+
+    t0 = time.perf_counter()
+    expected = [reference[idx] for idx in range(len(reference))]
+    t1 = time.perf_counter()
+    print(f"per-item (slow tokenizer):   {len(dataset) / (t1 - t0):10.1f} samples/s")
+
+    for name, tokenizer, num_proc in [
+        ("batched (slow tokenizer)", slow, 1),
+        ("batched (fast tokenizer)", fast, 1),
+        (f"batched x{args.num_proc} (fast tokenizer)", fast, args.num_proc),
+    ]:
+        with tempfile.TemporaryDirectory() as path:
+            t0 = time.perf_counter()
+            compile_dataset(
+                dataset,
+                tokenizer,
+                path,
+                batch_size=args.batch_size,
+                num_proc=num_proc,
+            )
+            t1 = time.perf_counter()
+
+            compiled = TorchMMapDataset(path, args.max_sequence_length)
+            mismatches = sum(
+                not torch.equal(compiled[idx]["input_ids"], expected[idx]["input_ids"])
+                or not torch.equal(compiled[idx]["labels"], expected[idx]["labels"])
+                for idx in range(len(compiled))
+            )
+
+        print(f"{name + ':':28} {len(dataset) / (t1 - t0):10.1f} samples/s, {mismatches} mismatches")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import os
+
+# TORCHINDUCTOR_CACHE_DIR as the user set it. Importing torch's inductor,
+# which transformers does, sets it to inductor's default, so it is read
+# before anything else is imported, see enable_compile_cache.
+USER_INDUCTOR_CACHE_DIR = os.environ.get("TORCHINDUCTOR_CACHE_DIR")
@@ -1,2 +1,5 @@
 from .fsdp_checkpoint import Checkpoint
-from .fsdp_utils import fsdp_model_state_dict_rank0
\ No newline at end of file
+from .fsdp_utils import fsdp_model_state_dict_rank0
+from .consolidate import consolidate_sharded_checkpoint
+from .retention import RetentionPolicy
+from .manifest import verify_checkpoint
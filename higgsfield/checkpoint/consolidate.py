@@ -0,0 +1,65 @@
+import tempfile
+from pathlib import Path
+
+import torch
+from torch.distributed.checkpoint.format_utils import dcp_to_torch_save
+
+from .mmap_utils import model_from_state_dict
+
+
+def load_sharded_model_state_dict(checkpoint_path, tmp_dir=None):
+    '''
+        Reads a sharded model checkpoint (the model/ directory of a
+        Checkpoint(..., sharded=True) save) into one full state dict in a
+        single process, without a process group.
+
+        The shards are merged into a torch.save file in tmp_dir (the
+        system's temporary directory by default) that is memory mapped
+        back and deleted.
+    '''
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        path = Path(tmp) / "model.pt"
+        dcp_to_torch_save(checkpoint_path, path)
+
+        # the mapping outlives the deleted file
+        state_dict = torch.load(path, mmap=True, weights_only=False)
+
+    return state_dict["model"]
+
+def consolidate_sharded_checkpoint(checkpoint_path, model_name, save_path, model_type="llama"):
+    '''
+        Merges the shards of a sharded checkpoint into a full huggingface
+        model at save_path.
+        
+        checkpoint_path: epoch_{epoch}_steps_{steps} directory or its model/
+            subdirectory
+        model_name: huggingface model the checkpoint was trained from
+        model_type: llama or mistral
+    '''
+    checkpoint_path = Path(checkpoint_path)
+    if (checkpoint_path / "model").is_dir():
+        checkpoint_path = checkpoint_path / "model"
+    
+    # the merged shards are staged next to the output
+    Path(save_path).parent.mkdir(parents=True, exist_ok=True)
+    state_dict = load_sharded_model_state_dict(checkpoint_path, tmp_dir=Path(save_path).parent)
+    
+    if model_type == "llama":
+        from transformers import LlamaConfig, LlamaForCausalLM
+        config, model_cls = LlamaConfig.from_pretrained(model_name), LlamaForCausalLM
+        
+    elif model_type == "mistral":
+        from transformers import MistralConfig, MistralForCausalLM
+        config, model_cls = MistralConfig.from_pretrained(model_name), MistralForCausalLM
+        
+    else:
+        raise ValueError(f"Unknown model type {model_type}, can be llama or mistral")
+    
+    # the embeddings may have been resized for added tokens
+    config.vocab_size = state_dict["model.embed_tokens.weight"].shape[0]
+    
+    # the merged tensors become the parameters, nothing is initialized
+    model = model_from_state_dict(model_cls, config, state_dict)
+    model.save_pretrained(save_path)
+    
+    return model
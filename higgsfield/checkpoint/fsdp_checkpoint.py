@@ -1,9 +1,13 @@
 import os
 import shutil
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
+import copy
 import time
 import json
+import random
+import numpy as np
 import torch
 import torch.distributed as dist
 
@@ -11,23 +15,72 @@ from torch.distributed.fsdp.fully_sharded_data_parallel import (
     FullyShardedDataParallel as FSDP,
 )
 
-from optimum.bettertransformer import BetterTransformer
+import torch.distributed.checkpoint as dist_cp
+from torch.distributed.checkpoint.optimizer import load_sharded_optimizer_state_dict
+from torch.distributed.optim import ZeroRedundancyOptimizer
 
-from .fsdp_utils import fsdp_model_state_dict_rank0
+from torch.distributed.fsdp.api import StateDictType
 
+from .fsdp_utils import (
+    fullstate_load_policy,
+    fsdp_model_state_dict_rank0,
+    fsdp_model_state_dict_sharded,
+    fsdp_optim_state_dict_sharded,
+    fsdp_optim_state_dict_rank0,
+)
+from .staging import PinnedStateDict
+from .mmap_utils import (
+    save_safetensors,
+    load_state_dict_mmap,
+)
+from .incremental import (
+    save_incremental,
+    load_incremental,
+    collect_garbage,
+)
+from .parallel_io import (
+    INDEX_SUFFIX,
+    save_parallel,
+)
+from .retention import (
+    prune_checkpoints,
+    next_save_index,
+    agreed_latest_checkpoint,
+)
+from .manifest import (
+    STAGING_SUFFIX,
+    Manifest,
+    ManifestFileSystem,
+    open_checkpoint_file,
+    staging_path,
+    write_manifest,
+    commit_checkpoint,
+    verify_checkpoint,
+)
 
-DEFAULT_CHECKPOINT_PATH = Path.home()  / \
-                          ".cache" / \
-                          "higgsfield" / \
-                          os.environ["PROJECT_NAME"] / \
-                          "experiments" / \
-                          os.environ["EXPERIMENT_NAME"] / \
-                          os.environ["RUN_NAME"]
+
+def default_checkpoint_path():
+    return Path.home()  / \
+           ".cache" / \
+           "higgsfield" / \
+           os.environ["PROJECT_NAME"] / \
+           "experiments" / \
+           os.environ["EXPERIMENT_NAME"] / \
+           os.environ["RUN_NAME"]
 
 class Checkpoint:
     '''
         Saving checkpoint to:
             ~/.cache/higgsfield/{project_name}/experiments/{experiment_name}/{run_name}
+        
+        A checkpoint is written into epoch_{epoch}_steps_{steps}.tmp and
+        renamed to epoch_{epoch}_steps_{steps} once every rank's files are on
+        disk, together with a manifest.json of their sizes and checksums.
+        A crash mid-save never leaves a directory that looks complete.
+        
+        Unless sharded, only rank 0 writes and reads the files, so the
+        cache directory may also be local to every node. Sharded
+        checkpoints need a filesystem all ranks see.
     '''
     def __init__(
         self,
@@ -35,75 +88,615 @@ class Checkpoint:
         optimizer=None,
         lr_scheduler=None,
         scaler=None,
+        loader=None,
+        sharded=False,
+        async_save=False,
+        retention=None,
+        incremental=False,
     ):
         '''
             model: Higgsfield.model
+            loader: LlamaLoader / MistralLoader, its position in the epoch
+                is saved so a resumed run continues at the next batch
+            sharded: every rank writes only its own shard of the model and
+                optimizer states in parallel (model/ and optimizer/
+                directories of torch.distributed.checkpoint) instead of
+                gathering them on rank 0 into model.safetensors.index.json
+                (size balanced .safetensors files written in parallel, see
+                save_parallel) and optimizer.pt.
+                The checkpoint directory has to be shared by all nodes.
+                See consolidate_sharded_checkpoint to get a full model back.
+            async_save: save() only takes a host copy of the states (into
+                reused pinned buffers when sharded) and returns, the files
+                are written and fsynced on a background thread. Only one save
+                is in flight at a time, the next save() first waits for the
+                previous one. Call wait() before reading the checkpoint or
+                exiting.
+            retention: RetentionPolicy, older checkpoints it does not keep
+                are deleted after every save.
+            incremental: the model is stored as content addressed chunks in
+                {save_dir}/chunks shared by all checkpoints of the run
+                (model.index.json lists them), unchanged tensors like frozen
+                weights are written once. Not available with sharded.
         '''
-        if os.environ["PROJECT_NAME"] and os.environ["EXPERIMENT_NAME"] and os.environ["RUN_NAME"]:
-            save_dir = DEFAULT_CHECKPOINT_PATH 
+        if os.environ.get("PROJECT_NAME") and os.environ.get("EXPERIMENT_NAME") and os.environ.get("RUN_NAME"):
+            save_dir = default_checkpoint_path()
         else:
             raise NotImplementedError("Support single GPU/process not implemeted yet")
             
+        if sharded and incremental:
+            raise ValueError("incremental checkpoints are only supported for sharded=False")
+        
+        if sharded and isinstance(optimizer, ZeroRedundancyOptimizer):
+            raise ValueError("sharding=\"zero1\" replicates the model on every rank, use sharded=False")
 
         self.save_dir     = save_dir
         self.model        = model
         self.optimizer    = optimizer
         self.lr_scheduler = lr_scheduler
         self.scaler       = scaler
+        self.loader       = loader
+        self.sharded      = sharded
+        self.async_save   = async_save
+        self.retention    = retention
+        self.incremental  = incremental
+        self.chunks_path  = Path(save_dir) / "chunks"
+        
+        self._executor      = None
+        self._future        = None
+        self._process_group = None
+        self._pinned        = PinnedStateDict()
     
     def save(self, epoch, steps=0, metadata={}):
         
         save_path = Path(self.save_dir) / f"epoch_{epoch}_steps_{steps}"
-        save_path.mkdir(exist_ok=True, parents=True)
-        
-        model_path     = save_path / "model.pt"
-        optimizer_path = save_path / "optimizer.pt"
         
         t0 = time.perf_counter()
-        save_distributed_model_rank0(model_path, self.model)
+        self.wait()
+        
+        staging = staging_path(save_path)
+        
+        # once per node, the save directory may be local to every node
+        if int(os.environ["LOCAL_RANK"]) == 0:
+            # left over by saves that crashed before their commit
+            for path in Path(self.save_dir).glob(f"epoch_*_steps_*{STAGING_SUFFIX}"):
+                if path != staging:
+                    shutil.rmtree(path, ignore_errors=True)
+            
+            staging.mkdir(parents=True, exist_ok=True)
+        dist.barrier()
+        
+        manifest = Manifest(staging)
+        
+        states = {}
+        if self.lr_scheduler:
+            states["lr_scheduler.pt"] = self.lr_scheduler.state_dict()
+        
+        if self.scaler:
+            states["scaler.pt"] = self.scaler.state_dict()
+        
+        if self.loader is not None:
+            states["loader.pt"] = self.loader.state_dict()
+        
+        metadata = dict(metadata, epoch=epoch, steps=steps, sharded=self.sharded)
+        
+        # only rank 0 writes metadata.json
+        if dist.get_rank() == 0:
+            metadata["save_index"] = next_save_index(self.save_dir)
         
-        if self.optimizer:
-            save_distributed_optimizer_rank0(optimizer_path, self.model, self.optimizer)
+        rng_state = get_rng_state()
+        
+        if not self.async_save:
+            if self.sharded:
+                save_distributed_model_sharded(staging / "model", self.model, manifest)
+                
+                if self.optimizer:
+                    save_distributed_optimizer_sharded(staging / "optimizer", self.model, self.optimizer, manifest)
+            elif self.incremental:
+                save_distributed_model_incremental(staging / "model.index.json", self.chunks_path, self.model, manifest)
+            
+                if self.optimizer:
+                    save_distributed_optimizer_rank0(staging / "optimizer.pt", self.model, self.optimizer, manifest)
+            else:
+                save_distributed_model_rank0(staging / f"model{INDEX_SUFFIX}", self.model, manifest)
+            
+                if self.optimizer:
+                    save_distributed_optimizer_rank0(staging / "optimizer.pt", self.model, self.optimizer, manifest)
+            
+            self._write_states(staging, save_path, manifest, states, rng_state, metadata, t0)
+            return
+        
+        if self.sharded:
+            model_state = fsdp_model_state_dict_sharded(self.model)
+            optim_state = fsdp_optim_state_dict_sharded(self.model, self.optimizer) if self.optimizer else None
+            
+            # sharded state dicts are views of the live parameters
+            model_state, optim_state = self._pinned.stage((model_state, optim_state))
+        else:
+            model_state = fsdp_model_state_dict_rank0(self.model)
+            optim_state = fsdp_optim_state_dict_rank0(self.model, self.optimizer) if self.optimizer else None
+        
+        # collectives of the background writer must not interleave with the
+        # ones of training on the default group
+        if self._process_group is None:
+            self._process_group = dist.new_group(backend="gloo")
+        
+        states, rng_state = copy.deepcopy((states, rng_state))
+        
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        
+        self._future = self._executor.submit(
+            self._write, staging, save_path, manifest, model_state, optim_state, states, rng_state, metadata, t0,
+        )
         t1 = time.perf_counter()
-
+        
         if int(os.environ["LOCAL_RANK"]) == 0:
-            print(f"State checkpoint of {steps} steps saved to {save_path}")
-            print(f"Checkpoint Time = {t1-t0:.4f}\n")
+            print(f"Checkpoint Stall Time = {t1-t0:.4f}\n")
+    
+    def wait(self):
+        '''
+            Blocks until the last asynchronous save is on disk and raises
+            its error, if any.
+        '''
+        if self._future is not None:
+            future, self._future = self._future, None
+            future.result()
+    
+    def _write(self, staging, save_path, manifest, model_state, optim_state, states, rng_state, metadata, t0):
+        if self.sharded:
+            self._pinned.synchronize()
+            
+            _save_state_dict({"model": model_state}, staging / "model", self._process_group, manifest)
+            
+            if optim_state is not None:
+                _save_state_dict({"optimizer": optim_state}, staging / "optimizer", self._process_group, manifest)
+        
+        elif dist.get_rank() == 0:
+            if self.incremental:
+                save_incremental(model_state, staging / "model.index.json", self.chunks_path, manifest=manifest)
+            else:
+                save_parallel(model_state, staging / f"model{INDEX_SUFFIX}", manifest=manifest)
+            
+            if optim_state is not None:
+                save_file(optim_state, staging / "optimizer.pt", manifest)
+        
+        self._write_states(staging, save_path, manifest, states, rng_state, metadata, t0, self._process_group)
+    
+    def _write_states(self, staging, save_path, manifest, states, rng_state, metadata, t0, process_group=None):
+        rank = dist.get_rank()
+        
+        # rank 0 writes the RNG states of every rank too, the other nodes
+        # may not see its directory
+        rng_states = [None] * dist.get_world_size(process_group) if rank == 0 else None
+        dist.gather_object(rng_state, rng_states, dst=0, group=process_group)
+        
+        if rank == 0:
+            for i, state in enumerate(rng_states):
+                states[f"rng_state_{i}.pt"] = state
+            
+            for name, state in states.items():
+                save_file(state, staging / name, manifest)
+            
+            with open_checkpoint_file(staging / "metadata.json", manifest) as jsonFile:
+                jsonFile.write(json.dumps(metadata).encode())
+        
+        self._commit(staging, save_path, manifest, metadata, t0, process_group)
+    
+    def _commit(self, staging, save_path, manifest, metadata, t0, process_group=None):
+        '''
+            Rank 0 collects the files every rank wrote, which also waits for
+            all of them, writes the manifest and renames the staging
+            directory to save_path.
+        '''
+        rank = dist.get_rank()
+        
+        files = [None] * dist.get_world_size(process_group) if rank == 0 else None
+        dist.gather_object(manifest.files, files, dst=0, group=process_group)
+        
+        if rank != 0:
+            return
+        
+        write_manifest(staging, {name: entry for rank_files in files for name, entry in rank_files.items()})
+        commit_checkpoint(staging, save_path)
+        t1 = time.perf_counter()
+        
+        print(f"State checkpoint of {metadata['steps']} steps saved to {save_path}")
+        print(f"Checkpoint Time = {t1-t0:.4f}\n")
+        
+        if self.retention:
+            self._prune(save_path)
+    
+    def _prune(self, save_path):
+        for path in prune_checkpoints(self.save_dir, self.retention, current=save_path):
+            print(f"Removed checkpoint {path}")
+        
+        # only rank 0 writes chunks and it is done with this save, so no
+        # chunk that is not in an index yet can be in the middle of a save
+        if self.chunks_path.exists():
+            index_paths = Path(self.save_dir).glob("*/model.index.json")
+            freed = collect_garbage(self.chunks_path, index_paths)
             
-            if self.lr_scheduler:
-                lr_scheduler_path = save_path / "lr_scheduler.pt"
-                torch.save(self.lr_scheduler.state_dict(), lr_scheduler_path)
+            if freed:
+                print(f"Removed {freed / 2**30:.2f} GiB of unused chunks\n")
+    
+    def load(self, checkpoint_path):
+        '''
+            Restores everything passed to Checkpoint from a directory written
+            by save(), in either format, and returns its metadata. The files
+            are checked against the manifest (sizes only) first.
             
-            if self.scaler:
-                scaler_path = save_path / "scaler.pt"
-                torch.save(self.grad_scaler.state_dict(), scaler_path)
+            Only rank 0 reads a full (not sharded) checkpoint and broadcasts
+            it, the other nodes don't need to see the directory.
+        '''
+        self.wait()
+        
+        load_path = Path(checkpoint_path)
+        rank      = dist.get_rank()
+        
+        header = None
+        if rank == 0:
+            header = _read_header(load_path)
+        problems, metadata, model_path = _broadcast_object(header)
+        
+        if problems:
+            raise RuntimeError(f"Checkpoint {load_path} is corrupt: {'; '.join(problems)}")
+        
+        t0 = time.perf_counter()
+        if model_path == "model":
+            visible = [None] * dist.get_world_size()
+            dist.all_gather_object(visible, (load_path / model_path).is_dir())
+            
+            missing = [i for i, exists in enumerate(visible) if not exists]
+            if missing:
+                raise RuntimeError(
+                    f"Sharded checkpoint {load_path} is not visible to ranks {missing}, loading "
+                    f"it needs the checkpoint directory on a filesystem shared by all nodes"
+                )
+            
+            load_distributed_model_sharded(load_path / "model", self.model)
+            
+            if self.optimizer:
+                load_distributed_optimizer_sharded(load_path / "optimizer", self.model, self.optimizer)
+        else:
+            load_distributed_model(load_path / model_path, self.model)
+            
+            if self.optimizer:
+                load_distributed_optimizer_rank0(load_path / "optimizer.pt", self.model, self.optimizer)
+        t1 = time.perf_counter()
+        
+        names = []
+        if self.lr_scheduler:
+            names.append("lr_scheduler.pt")
+        
+        if self.scaler:
+            names.append("scaler.pt")
+        
+        if self.loader is not None:
+            names.append("loader.pt")
+        
+        states, rng_states = None, None
+        if rank == 0:
+            states = {
+                name: torch.load(load_path / name)
+                for name in names
+                if name != "loader.pt" or (load_path / name).exists()
+            }
+            rng_states = [
+                torch.load(path, weights_only=False) if path.exists() else None
+                for path in (load_path / f"rng_state_{i}.pt" for i in range(dist.get_world_size()))
+            ]
+        states = _broadcast_object(states)
+        
+        if self.lr_scheduler:
+            self.lr_scheduler.load_state_dict(states["lr_scheduler.pt"])
+        
+        if self.scaler:
+            self.scaler.load_state_dict(states["scaler.pt"])
+        
+        if "loader.pt" in states:
+            self.loader.load_state_dict(states["loader.pt"])
+        
+        rng_state = [None]
+        dist.scatter_object_list(rng_state, rng_states, src=0)
+        
+        if rng_state[0] is not None:
+            set_rng_state(rng_state[0])
+        
+        if int(os.environ["LOCAL_RANK"]) == 0:
+            print(f"State checkpoint of {metadata['steps']} steps loaded from {load_path}")
+            print(f"Checkpoint Load Time = {t1-t0:.4f}\n")
+        
+        return metadata
+    
+    def latest(self):
+        '''
+            Newest complete checkpoint of this run, None if there is none,
+            the one rank 0 sees on every rank.
+        '''
+        self.wait()
+        return agreed_latest_checkpoint(self.save_dir)
+    
+    def resume(self):
+        '''
+            Continues the run from its newest complete checkpoint: restores
+            the model, optimizer, lr_scheduler, scaler, loader position and
+            the RNG states of every rank. Returns the checkpoint's metadata,
+            None if the run has no checkpoint yet.
             
-            metadata_path = save_path / "metadata.json"
-            metadata["epoch"] = epoch
-            metadata["steps"] = steps
+            Sharded checkpoints are read by all ranks in parallel, each rank
+            reading only its own shards, full ones by rank 0 alone.
+        '''
+        checkpoint_path = self.latest()
+        if checkpoint_path is None:
+            return None
+        
+        return self.load(checkpoint_path)
+
+def get_rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state()
+    
+    return state
 
-            with open(metadata_path, "w+") as jsonFile:
-                json.dump(metadata, jsonFile) 
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state(state["cuda"])
+
+def _broadcast_object(obj, src=0):
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
 
-def save_distributed_model_rank0(checkpoint_path, model):
+def _read_header(load_path):
+    '''
+        Problems found by verify_checkpoint, metadata and the model file
+        (or directory, if sharded) of the checkpoint at load_path.
+    '''
+    if not (load_path / "metadata.json").exists():
+        return ["metadata.json is missing"], None, None
+    
+    problems = verify_checkpoint(load_path)
+    if problems:
+        return problems, None, None
+    
+    with open(load_path / "metadata.json") as jsonFile:
+        metadata = json.load(jsonFile)
+    
+    for model_path in ("model", f"model{INDEX_SUFFIX}", "model.index.json", "model.safetensors", "model.pt"):
+        if (load_path / model_path).exists():
+            return [], metadata, model_path
+    
+    return ["model is missing"], None, None
+
+def save_distributed_model_rank0(checkpoint_path, model, manifest=None):
     '''
         model: FSDP
+        
+        Written as safetensors if checkpoint_path ends with .safetensors,
+        as several .safetensors files written in parallel if it ends with
+        .safetensors.index.json.
     '''
     rank = dist.get_rank()
     
     cpu_state = fsdp_model_state_dict_rank0(model)
         
-    if rank == 0:
-        torch.save(cpu_state, checkpoint_path)
+    if rank == 0 and str(checkpoint_path).endswith(INDEX_SUFFIX):
+        save_parallel(cpu_state, checkpoint_path, manifest=manifest)
+    elif rank == 0 and str(checkpoint_path).endswith(".safetensors"):
+        save_safetensors(cpu_state, checkpoint_path, manifest)
+    elif rank == 0:
+        save_file(cpu_state, checkpoint_path, manifest)
     
-def save_distributed_optimizer_rank0(checkpoint_path, model, optimizer):
+def save_distributed_optimizer_rank0(checkpoint_path, model, optimizer, manifest=None):
     '''
         model: FSDP
         optimizer: torch.optim
     '''
     rank = dist.get_rank()
     
-    optim_state = FSDP.full_optim_state_dict(model, optimizer)
+    optim_state = fsdp_optim_state_dict_rank0(model, optimizer)
 
     if rank == 0:
-        torch.save(optim_state, checkpoint_path)
\ No newline at end of file
+        save_file(optim_state, checkpoint_path, manifest)
+
+def save_distributed_model_incremental(checkpoint_path, chunks_path, model, manifest=None):
+    '''
+        model: FSDP
+        
+        checkpoint_path: index of the model's chunks, see save_incremental
+    '''
+    rank = dist.get_rank()
+    
+    cpu_state = fsdp_model_state_dict_rank0(model)
+        
+    if rank == 0:
+        save_incremental(cpu_state, checkpoint_path, chunks_path, manifest=manifest)
+
+def load_distributed_model(checkpoint_path, model):
+    '''
+        model: FSDP
+        
+        Only rank 0 reads the model, memory mapped (.safetensors.index.json,
+        .safetensors or .pt) or one tensor at a time from the chunks of
+        model.index.json. The parameters of one FSDP unit at a time are
+        gathered, filled in by rank 0 and broadcast, every rank keeps its
+        own shard.
+    '''
+    rank = dist.get_rank()
+    
+    cpu_state, shapes = None, None
+    if rank == 0 and str(checkpoint_path).endswith(".index.json") and not str(checkpoint_path).endswith(INDEX_SUFFIX):
+        cpu_state = load_incremental(checkpoint_path)
+        shapes    = cpu_state.shapes
+    elif rank == 0:
+        cpu_state = load_state_dict_mmap(checkpoint_path)
+        shapes    = {key: tuple(tensor.shape) for key, tensor in cpu_state.items()}
+    
+    shapes = _broadcast_object(shapes)
+    device = torch.device("cuda", torch.cuda.current_device()) if torch.cuda.is_available() else torch.device("cpu")
+    
+    units = [(prefix, module) for prefix, module in model.named_modules() if isinstance(module, FSDP)]
+    
+    loaded = set()
+    for prefix, unit in units:
+        with FSDP.summon_full_params(unit, recurse=False, writeback=True), torch.no_grad():
+            for key, tensor in _unit_tensors(prefix, unit):
+                if key not in shapes:
+                    raise RuntimeError(f"{key} is missing from {checkpoint_path}")
+                
+                if shapes[key] != tuple(tensor.shape):
+                    raise RuntimeError(
+                        f"{key} of {checkpoint_path} has shape {shapes[key]}, the model's {tuple(tensor.shape)}"
+                    )
+                
+                data = tensor.to(device)
+                if rank == 0:
+                    data.copy_(cpu_state[key])
+                
+                dist.broadcast(data, src=0)
+                tensor.copy_(data)
+                loaded.add(key)
+    
+    unexpected = shapes.keys() - loaded
+    if unexpected:
+        raise RuntimeError(f"{checkpoint_path} has keys the model does not: {sorted(unexpected)}")
+
+def _unit_tensors(prefix, unit):
+    '''
+        Parameters and persistent buffers of an FSDP unit, not of the units
+        nested in it, with their state dict keys. The parameters are only
+        the full ones inside summon_full_params.
+    '''
+    modules = [(prefix, unit)]
+    while modules:
+        prefix, module = modules.pop()
+        
+        tensors = list(module.named_parameters(recurse=False)) + [
+            (name, buffer) for name, buffer in module.named_buffers(recurse=False)
+            if name not in module._non_persistent_buffers_set
+        ]
+        for name, tensor in tensors:
+            if name != "_flat_param":
+                yield _state_dict_key(f"{prefix}.{name}"), tensor
+        
+        for name, child in module.named_children():
+            if not isinstance(child, FSDP):
+                modules.append((f"{prefix}.{name}", child))
+
+def _state_dict_key(name):
+    # FSDP and activation checkpointing wrappers are not in state dict keys
+    return ".".join(
+        part for part in name.split(".")
+        if part and part not in ("_fsdp_wrapped_module", "_checkpoint_wrapped_module")
+    )
+
+def load_distributed_optimizer_rank0(checkpoint_path, model, optimizer):
+    '''
+        model: FSDP
+        optimizer: torch.optim
+        
+        Rank 0 reads optimizer.pt and scatters the shards to the other ranks.
+        A ZeroRedundancyOptimizer is broadcast the full state and keeps its
+        own partition.
+    '''
+    rank = dist.get_rank()
+    
+    if isinstance(optimizer, ZeroRedundancyOptimizer):
+        optim_state = torch.load(checkpoint_path, map_location="cpu") if rank == 0 else None
+        optimizer.load_state_dict(_broadcast_object(optim_state))
+        return
+    
+    optim_state = torch.load(checkpoint_path, map_location="cpu") if rank == 0 else None
+    optim_state = FSDP.scatter_full_optim_state_dict(optim_state, model)
+    
+    optimizer.load_state_dict(optim_state)
+
+def save_file(obj, checkpoint_path, manifest=None):
+    '''
+        torch.save that returns once the file is on disk.
+    '''
+    with open_checkpoint_file(checkpoint_path, manifest) as f:
+        torch.save(obj, f)
+
+def _save_state_dict(state_dict, checkpoint_path, process_group=None, manifest=None):
+    storage_writer = dist_cp.FileSystemWriter(checkpoint_path)
+    if manifest is not None:
+        storage_writer.fs = ManifestFileSystem(manifest)
+    
+    # dist_cp.save replaced dist_cp.save_state_dict in torch 2.2
+    save = getattr(dist_cp, "save", None) or dist_cp.save_state_dict
+    save(
+        state_dict,
+        storage_writer=storage_writer,
+        process_group=process_group,
+    )
+
+def _load_state_dict(state_dict, checkpoint_path):
+    load = getattr(dist_cp, "load", None) or dist_cp.load_state_dict
+    load(state_dict, storage_reader=dist_cp.FileSystemReader(checkpoint_path))
+
+def save_distributed_model_sharded(checkpoint_path, model, manifest=None):
+    '''
+        model: FSDP
+        
+        Every rank writes its own shard to checkpoint_path/__{rank}_0.distcp,
+        rank 0 also writes the .metadata index.
+    '''
+    _save_state_dict(
+        {"model": fsdp_model_state_dict_sharded(model)},
+        checkpoint_path,
+        manifest=manifest,
+    )
+
+def save_distributed_optimizer_sharded(checkpoint_path, model, optimizer, manifest=None):
+    '''
+        model: FSDP
+        optimizer: torch.optim
+    '''
+    _save_state_dict(
+        {"optimizer": fsdp_optim_state_dict_sharded(model, optimizer)},
+        checkpoint_path,
+        manifest=manifest,
+    )
+
+def load_distributed_model_sharded(checkpoint_path, model):
+    '''
+        model: FSDP
+        
+        Every rank reads only the parts of the shards it owns, so the world
+        size may differ from the one the checkpoint was saved with.
+    '''
+    with FSDP.state_dict_type(model, StateDictType.SHARDED_STATE_DICT):
+        state_dict = {"model": model.state_dict()}
+        _load_state_dict(state_dict, checkpoint_path)
+        model.load_state_dict(state_dict["model"])
+
+def load_distributed_optimizer_sharded(checkpoint_path, model, optimizer):
+    '''
+        model: FSDP
+        optimizer: torch.optim
+    '''
+    with FSDP.state_dict_type(model, StateDictType.SHARDED_STATE_DICT):
+        optim_state = load_sharded_optimizer_state_dict(
+            model_state_dict=model.state_dict(),
+            optimizer_key="optimizer",
+            storage_reader=dist_cp.FileSystemReader(checkpoint_path),
+        )
+        optim_state = FSDP.optim_state_dict_to_load(
+            model,
+            optimizer,
+            optim_state["optimizer"],
+        )
+        
+    optimizer.load_state_dict(optim_state)
@@ -1,3 +1,7 @@
+import torch
+import torch.distributed as dist
+from torch.utils._pytree import tree_map
+from torch.distributed.optim import ZeroRedundancyOptimizer
 from torch.distributed.fsdp.fully_sharded_data_parallel import (
     FullyShardedDataParallel as FSDP,
 )
@@ -12,10 +16,48 @@ fullstate_save_policy = FullStateDictConfig(
     rank0_only=True,
 )
 
+fullstate_load_policy = FullStateDictConfig(
+    offload_to_cpu=True,
+    rank0_only=False,
+)
+
 def fsdp_model_state_dict_rank0(model):
     with FSDP.state_dict_type(
         model, StateDictType.FULL_STATE_DICT, fullstate_save_policy
     ):
         cpu_state = model.state_dict()
         
-    return cpu_state
\ No newline at end of file
+    return cpu_state
+
+def fsdp_model_state_dict_sharded(model):
+    '''
+        This rank's shard of every parameter, nothing is gathered.
+    '''
+    with FSDP.state_dict_type(model, StateDictType.SHARDED_STATE_DICT):
+        sharded_state = model.state_dict()
+        
+    return sharded_state
+
+def fsdp_optim_state_dict_sharded(model, optimizer):
+    with FSDP.state_dict_type(model, StateDictType.SHARDED_STATE_DICT):
+        sharded_state = FSDP.optim_state_dict(model, optimizer)
+        
+    return sharded_state
+
+def fsdp_optim_state_dict_rank0(model, optimizer):
+    '''
+        Full optimizer state on rank 0, gathered from the shards of every
+        rank. A ZeroRedundancyOptimizer (sharding="zero1") is consolidated
+        and copied to CPU.
+    '''
+    if not isinstance(optimizer, ZeroRedundancyOptimizer):
+        return FSDP.full_optim_state_dict(model, optimizer)
+    
+    optimizer.consolidate_state_dict(to=0)
+    if dist.get_rank() != 0:
+        return {}
+    
+    return tree_map(
+        lambda t: t.detach().to("cpu", copy=True) if isinstance(t, torch.Tensor) else t,
+        optimizer.state_dict(),
+    )
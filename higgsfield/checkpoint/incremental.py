@@ -0,0 +1,188 @@
+import os
+import mmap
+import json
+import hashlib
+import threading
+from pathlib import Path
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from .manifest import open_checkpoint_file
+
+CHUNK_SIZE = 64 * 2**20
+
+def _tensor_bytes(tensor):
+    return tensor.detach().contiguous().reshape(-1).view(torch.uint8).numpy()
+
+def _chunk_path(chunks_path, digest):
+    return Path(chunks_path) / digest[:2] / digest
+
+def _write_chunk(chunks_path, data):
+    digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+    path = _chunk_path(chunks_path, digest)
+
+    if path.exists():
+        return digest, 0
+
+    path.parent.mkdir(exist_ok=True, parents=True)
+
+    # a chunk is only ever visible complete, a later save trusts any
+    # existing chunk
+    tmp_path = path.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    return digest, len(data)
+
+def save_incremental(state_dict, index_path, chunks_path, chunk_size=CHUNK_SIZE, num_threads=8, manifest=None):
+    '''
+        Writes every tensor of state_dict as content addressed chunks of
+        chunk_size bytes into chunks_path, a store shared by all checkpoints
+        of a run, and the chunks of every tensor into index_path. Chunks
+        already in the store, e.g. of frozen weights or of tensors that did
+        not change since an earlier save, are not written again. The index
+        is added to manifest, if given.
+
+        Returns the number of bytes written.
+    '''
+    index_path = Path(index_path)
+
+    tensors, jobs = {}, []
+    for key, tensor in state_dict.items():
+        data = _tensor_bytes(tensor)
+
+        tensors[key] = {
+            "dtype": str(tensor.dtype).split(".")[-1],
+            "shape": list(tensor.shape),
+            "chunks": [],
+        }
+        for offset in range(0, len(data), chunk_size):
+            jobs.append((key, data[offset:offset + chunk_size]))
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        results = executor.map(lambda job: _write_chunk(chunks_path, job[1]), jobs)
+
+        for (key, _), (digest, size) in zip(jobs, results):
+            tensors[key]["chunks"].append(digest)
+            written += size
+
+    index = {
+        "chunks_path": os.path.relpath(chunks_path, index_path.parent),
+        "chunk_size": chunk_size,
+        "tensors": tensors,
+    }
+    with open_checkpoint_file(index_path, manifest) as f:
+        f.write(json.dumps(index).encode())
+
+    return written
+
+class IncrementalStateDict(Mapping):
+    '''
+        State dict of a model.index.json that reads a tensor only when it
+        is looked up. A tensor of one chunk is memory mapped, a larger one
+        read from its chunks in parallel, so at most one tensor is in memory
+        at a time as long as the caller doesn't keep them.
+    '''
+    def __init__(self, index_path, num_threads=8):
+        index_path = Path(index_path)
+
+        with open(index_path) as f:
+            index = json.load(f)
+
+        self.chunks_path = index_path.parent / index["chunks_path"]
+        self.chunk_size  = index["chunk_size"]
+        self.tensors     = index["tensors"]
+        self.num_threads = num_threads
+        self.shapes      = {key: tuple(entry["shape"]) for key, entry in self.tensors.items()}
+
+    def __getitem__(self, key):
+        entry  = self.tensors[key]
+        dtype  = getattr(torch, entry["dtype"])
+        chunks = [_chunk_path(self.chunks_path, digest) for digest in entry["chunks"]]
+
+        if len(chunks) == 1:
+            with open(chunks[0], "rb") as f:
+                # copy on write, the pages are only read from the page cache
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+            return torch.frombuffer(data, dtype=dtype).view(entry["shape"])
+
+        tensor = torch.empty(entry["shape"], dtype=dtype)
+        data   = _tensor_bytes(tensor)
+
+        def read_chunk(i):
+            with open(chunks[i], "rb") as f:
+                f.readinto(memoryview(data[i * self.chunk_size:(i + 1) * self.chunk_size]))
+
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            list(executor.map(read_chunk, range(len(chunks))))
+
+        return tensor
+
+    def __iter__(self):
+        return iter(self.tensors)
+
+    def __len__(self):
+        return len(self.tensors)
+
+def load_incremental(index_path, num_threads=8):
+    '''
+        Reads a state dict written by save_incremental, lazily, see
+        IncrementalStateDict.
+    '''
+    return IncrementalStateDict(index_path, num_threads)
+
+def verify_incremental(index_path, checksums=False):
+    '''
+        Returns the chunks of index_path missing from the store, with
+        checksums=True also the ones whose content does not match their name.
+    '''
+    index_path = Path(index_path)
+
+    with open(index_path) as f:
+        index = json.load(f)
+
+    chunks_path = index_path.parent / index["chunks_path"]
+
+    problems = []
+    for digest in referenced_chunks([index_path]):
+        path = _chunk_path(chunks_path, digest)
+
+        if not path.exists():
+            problems.append(f"chunk {digest} is missing")
+        elif checksums and hashlib.blake2b(path.read_bytes(), digest_size=20).hexdigest() != digest:
+            problems.append(f"chunk {digest} does not match its checksum")
+
+    return problems
+
+def referenced_chunks(index_paths):
+    digests = set()
+    for index_path in index_paths:
+        with open(index_path) as f:
+            index = json.load(f)
+
+        for entry in index["tensors"].values():
+            digests.update(entry["chunks"])
+
+    return digests
+
+def collect_garbage(chunks_path, index_paths):
+    '''
+        Deletes the chunks of chunks_path that none of index_paths uses.
+        Returns the number of bytes freed.
+    '''
+    keep = referenced_chunks(index_paths)
+
+    freed = 0
+    for path in Path(chunks_path).glob("*/*"):
+        if path.name not in keep and not path.name.endswith(".tmp"):
+            freed += path.stat().st_size
+            path.unlink(missing_ok=True)
+
+    return freed
@@ -0,0 +1,177 @@
+import os
+import json
+import zlib
+import shutil
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+from torch.distributed.checkpoint.filesystem import FileSystem
+
+
+MANIFEST_NAME  = "manifest.json"
+STAGING_SUFFIX = ".tmp"
+
+class ChecksumWriter:
+    '''
+        Binary file wrapper keeping the size and crc32 of everything written
+        through it, so the manifest needs no second read pass.
+    '''
+    def __init__(self, f):
+        self.f     = f
+        self.size  = 0
+        self.crc32 = 0
+
+    def write(self, data):
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self.size += memoryview(data).nbytes
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+class Manifest:
+    '''
+        Size and crc32 of every file one rank wrote into a checkpoint
+        directory, keyed by the path relative to root.
+    '''
+    def __init__(self, root):
+        self.root  = Path(root)
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def add(self, path, size, crc32):
+        with self._lock:
+            self.files[self._key(path)] = {"size": size, "crc32": f"{crc32:08x}"}
+
+    def rename(self, path, new_path):
+        with self._lock:
+            self.files[self._key(new_path)] = self.files.pop(self._key(path))
+
+    def _key(self, path):
+        return Path(path).relative_to(self.root).as_posix()
+
+@contextmanager
+def open_checkpoint_file(path, manifest=None):
+    '''
+        Opens path for binary writing and returns once the file is on disk.
+        The file is added to manifest, if given.
+    '''
+    with open(path, "wb") as f:
+        writer = ChecksumWriter(f)
+        yield writer
+        f.flush()
+        os.fsync(f.fileno())
+
+    if manifest is not None:
+        manifest.add(path, writer.size, writer.crc32)
+
+class ManifestFileSystem(FileSystem):
+    '''
+        torch.distributed.checkpoint file system adding every file written
+        by FileSystemWriter to a manifest.
+    '''
+    def __init__(self, manifest):
+        super().__init__()
+        self.manifest = manifest
+
+    @contextmanager
+    def create_stream(self, path, mode):
+        if "w" not in mode:
+            with super().create_stream(path, mode) as stream:
+                yield stream
+            return
+
+        with super().create_stream(path, mode) as stream:
+            writer = ChecksumWriter(stream)
+            yield writer
+
+        self.manifest.add(path, writer.size, writer.crc32)
+
+    def rename(self, path, new_path):
+        super().rename(path, new_path)
+        self.manifest.rename(path, new_path)
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def staging_path(checkpoint_path):
+    checkpoint_path = Path(checkpoint_path)
+    return checkpoint_path.with_name(checkpoint_path.name + STAGING_SUFFIX)
+
+def write_manifest(checkpoint_path, files):
+    with open_checkpoint_file(Path(checkpoint_path) / MANIFEST_NAME) as f:
+        f.write(json.dumps({"files": files}, indent=1).encode())
+
+def commit_checkpoint(staging, checkpoint_path):
+    '''
+        Makes the fully written staging directory visible as checkpoint_path
+        with a single rename, replacing an older checkpoint of that name.
+    '''
+    staging, checkpoint_path = Path(staging), Path(checkpoint_path)
+
+    replaced = None
+    if checkpoint_path.exists():
+        replaced = checkpoint_path.with_name(checkpoint_path.name + ".old")
+        shutil.rmtree(replaced, ignore_errors=True)
+        os.rename(checkpoint_path, replaced)
+
+    os.rename(staging, checkpoint_path)
+    _fsync_dir(checkpoint_path.parent)
+
+    if replaced is not None:
+        shutil.rmtree(replaced, ignore_errors=True)
+
+def _file_crc32(path, block_size=16 * 2**20):
+    crc32 = 0
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            crc32 = zlib.crc32(block, crc32)
+    return crc32
+
+def verify_checkpoint(checkpoint_path, checksums=False):
+    '''
+        Checks a checkpoint against its manifest.json and returns the
+        problems found, an empty list if it is intact.
+
+        By default only the size of every file is compared, which takes one
+        stat per file. checksums=True also reads every file back and compares
+        its crc32 (and the content hash of incremental chunks).
+
+        Checkpoints saved before manifests were written are not checked.
+    '''
+    from .incremental import verify_incremental
+
+    checkpoint_path = Path(checkpoint_path)
+
+    try:
+        with open(checkpoint_path / MANIFEST_NAME) as f:
+            files = json.load(f)["files"]
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError, KeyError) as e:
+        return [f"{MANIFEST_NAME} is unreadable: {e}"]
+
+    problems = []
+    for name, entry in files.items():
+        path = checkpoint_path / name
+
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            problems.append(f"{name} is missing")
+            continue
+
+        if size != entry["size"]:
+            problems.append(f"{name} has {size} bytes, expected {entry['size']}")
+        elif checksums and f"{_file_crc32(path):08x}" != entry["crc32"]:
+            problems.append(f"{name} does not match its checksum")
+
+    if "model.index.json" in files and not problems:
+        problems.extend(verify_incremental(checkpoint_path / "model.index.json", checksums))
+
+    return problems
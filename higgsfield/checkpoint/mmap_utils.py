@@ -0,0 +1,165 @@
+import json
+import struct
+from contextlib import contextmanager
+
+import torch
+import torch.nn as nn
+
+from .manifest import open_checkpoint_file
+
+
+@contextmanager
+def init_empty_weights():
+    '''
+        Parameters of the modules created inside are put on the meta device
+        right away, so they take no memory and their random initialization
+        is skipped. Buffers are created as usual, non-persistent ones like
+        rotary inv_freq are not in checkpoints.
+    '''
+    register_parameter = nn.Module.register_parameter
+
+    def register_empty_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            param_cls = type(module._parameters[name])
+            module._parameters[name] = param_cls(
+                module._parameters[name].to("meta"),
+                requires_grad=param.requires_grad,
+            )
+
+    nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        nn.Module.register_parameter = register_parameter
+
+SAFETENSORS_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+
+def save_safetensors(state_dict, checkpoint_path, manifest=None):
+    '''
+        Writes a state dict as safetensors, which load_state_dict_mmap maps
+        without copying. Tensors are streamed to the file one at a time
+        instead of being serialized into one buffer first, the file is
+        added to manifest, if given.
+    '''
+    from .incremental import _tensor_bytes
+
+    # largest items first keeps every tensor aligned to its element size
+    keys = sorted(state_dict, key=lambda key: (-state_dict[key].element_size(), key))
+
+    header, offset = {"__metadata__": {"format": "pt"}}, 0
+    for key in keys:
+        tensor = state_dict[key]
+        size   = tensor.numel() * tensor.element_size()
+
+        header[key] = {
+            "dtype": SAFETENSORS_DTYPES[tensor.dtype],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + size],
+        }
+        offset += size
+
+    header = json.dumps(header, separators=(",", ":")).encode()
+    header += b" " * (-len(header) % 8)
+
+    with open_checkpoint_file(checkpoint_path, manifest) as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+
+        for key in keys:
+            f.write(_tensor_bytes(state_dict[key]))
+
+def read_safetensors(checkpoint_path):
+    '''
+        Reads a .safetensors file into memory with one read per tensor
+        straight into the tensor's storage, which releases the GIL, so
+        several files can be read by parallel threads.
+    '''
+    from .incremental import _tensor_bytes
+
+    dtypes = {name: dtype for dtype, name in SAFETENSORS_DTYPES.items()}
+
+    with open(checkpoint_path, "rb") as f:
+        header_size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        header.pop("__metadata__", None)
+
+        state_dict = {}
+        for key, entry in sorted(header.items(), key=lambda item: item[1]["data_offsets"][0]):
+            tensor = torch.empty(entry["shape"], dtype=dtypes[entry["dtype"]])
+
+            f.seek(8 + header_size + entry["data_offsets"][0])
+            f.readinto(memoryview(_tensor_bytes(tensor)))
+            state_dict[key] = tensor
+
+    return {key: state_dict[key] for key in header}
+
+def load_state_dict_mmap(checkpoint_path):
+    '''
+        Memory maps a .safetensors file, the files of a
+        .safetensors.index.json (see save_parallel) or a torch.save
+        checkpoint. Pages are only read when a tensor is used and stay in
+        the page cache instead of the process heap.
+    '''
+    if str(checkpoint_path).endswith(".safetensors.index.json"):
+        from .parallel_io import index_files
+
+        state_dict = {}
+        for path in index_files(checkpoint_path):
+            state_dict.update(load_state_dict_mmap(path))
+        return state_dict
+
+    if str(checkpoint_path).endswith(".safetensors"):
+        from safetensors.torch import load_file
+        return load_file(checkpoint_path, device="cpu")
+
+    return torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+
+def load_model_from_checkpoint(model_cls, config, checkpoint_path, dtype=None):
+    '''
+        Builds model_cls(config) without allocating or initializing its
+        parameters and makes the checkpoint tensors its parameters.
+
+        dtype: dtype of the floating point parameters, by default the one
+            model_cls(config) would have. Tensors already stored in it are
+            used zero-copy from the memory map, the rest is converted.
+    '''
+    return model_from_state_dict(model_cls, config, load_state_dict_mmap(checkpoint_path), dtype=dtype)
+
+def model_from_state_dict(model_cls, config, state_dict, dtype=None):
+    '''
+        Builds model_cls(config) without allocating or initializing its
+        parameters and makes the tensors of state_dict its parameters, see
+        load_model_from_checkpoint.
+    '''
+    with init_empty_weights():
+        model = model_cls(config)
+
+    expected = model.state_dict()
+
+    for key, tensor in state_dict.items():
+        target = expected[key].dtype if key in expected else tensor.dtype
+        if dtype is not None and tensor.is_floating_point():
+            target = dtype
+
+        if tensor.dtype != target:
+            state_dict[key] = tensor.to(target)
+
+    model.load_state_dict(state_dict, assign=True)
+    model.tie_weights()
+
+    if dtype is not None:
+        model.to(dtype)
+
+    return model
@@ -0,0 +1,81 @@
+import json
+import heapq
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from .manifest import open_checkpoint_file
+from .mmap_utils import save_safetensors, read_safetensors
+
+
+INDEX_SUFFIX = ".safetensors.index.json"
+
+def _balance(state_dict, num_files):
+    '''
+        Splits the keys of state_dict into num_files groups of about the
+        same number of bytes, largest tensors first into the lightest group.
+    '''
+    sizes = {key: tensor.numel() * tensor.element_size() for key, tensor in state_dict.items()}
+
+    groups = [(0, i, []) for i in range(min(num_files, len(sizes)))]
+    for key in sorted(sizes, key=lambda key: -sizes[key]):
+        size, i, keys = heapq.heappop(groups)
+        keys.append(key)
+        heapq.heappush(groups, (size + sizes[key], i, keys))
+
+    return [keys for _, _, keys in sorted(groups, key=lambda group: group[1]) if keys]
+
+def save_parallel(state_dict, index_path, num_files=8, num_threads=8, manifest=None):
+    '''
+        Writes a state dict as num_files size balanced .safetensors files
+        next to index_path, {name}-0000i-of-0000n.safetensors, by
+        num_threads threads at once, so a large state dict is not limited
+        by a single file stream. index_path ({name}.safetensors.index.json)
+        maps every key to its file, the layout huggingface uses for sharded
+        checkpoints. Every file is added to manifest, if given.
+
+        Returns the number of bytes written.
+    '''
+    index_path = Path(index_path)
+    if not index_path.name.endswith(INDEX_SUFFIX):
+        raise ValueError(f"index_path has to end with {INDEX_SUFFIX}, got {index_path}")
+
+    name   = index_path.name[:-len(INDEX_SUFFIX)]
+    groups = _balance(state_dict, num_files)
+    files  = [f"{name}-{i + 1:05d}-of-{len(groups):05d}.safetensors" for i in range(len(groups))]
+
+    def write(job):
+        file, keys = job
+        save_safetensors({key: state_dict[key] for key in keys}, index_path.parent / file, manifest)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        list(executor.map(write, zip(files, groups)))
+
+    total_size = sum(tensor.numel() * tensor.element_size() for tensor in state_dict.values())
+    index = {
+        "metadata": {"total_size": total_size},
+        "weight_map": {key: file for file, keys in zip(files, groups) for key in keys},
+    }
+    with open_checkpoint_file(index_path, manifest) as f:
+        f.write(json.dumps(index, indent=2).encode())
+
+    return total_size
+
+def index_files(index_path):
+    index_path = Path(index_path)
+
+    with open(index_path) as f:
+        weight_map = json.load(f)["weight_map"]
+
+    return [index_path.parent / file for file in sorted(set(weight_map.values()))]
+
+def load_parallel(index_path, num_threads=8):
+    '''
+        Reads a state dict written by save_parallel into memory, num_threads
+        files at a time. See load_state_dict_mmap to map it instead.
+    '''
+    state_dict = {}
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for file_state_dict in executor.map(read_safetensors, index_files(index_path)):
+            state_dict.update(file_state_dict)
+
+    return state_dict
@@ -0,0 +1,152 @@
+import re
+import json
+import shutil
+from pathlib import Path
+
+import torch.distributed as dist
+
+from .manifest import verify_checkpoint
+
+
+CHECKPOINT_NAME = re.compile(r"^epoch_(\d+)_steps_(\d+)$")
+
+def list_checkpoints(save_dir):
+    '''
+        Complete checkpoints of save_dir as (path, metadata) pairs, oldest
+        first. Checkpoints whose files do not match their manifest, e.g.
+        truncated by a full disk, are skipped.
+    '''
+    save_dir = Path(save_dir)
+    if not save_dir.is_dir():
+        return []
+
+    checkpoints = []
+    for path in save_dir.iterdir():
+        match = CHECKPOINT_NAME.match(path.name)
+        if not match or not (path / "metadata.json").exists():
+            continue
+
+        if verify_checkpoint(path):
+            continue
+
+        with open(path / "metadata.json") as jsonFile:
+            metadata = json.load(jsonFile)
+
+        checkpoints.append(((int(match[1]), int(match[2])), path, metadata))
+
+    return [(path, metadata) for _, path, metadata in sorted(checkpoints, key=lambda c: c[0])]
+
+class RetentionPolicy:
+    '''
+        Which checkpoints of a run Checkpoint keeps, every other complete
+        checkpoint is deleted after each save. A checkpoint is kept if any
+        rule keeps it, with no rule set everything is kept.
+
+        keep_last: the latest keep_last checkpoints.
+        keep_every: every keep_every-th checkpoint the run saved, by the
+            metadata["save_index"] Checkpoint.save() numbers them with.
+        keep_best: the keep_best checkpoints with the lowest (mode="min")
+            or highest (mode="max") metadata[metric], see
+            Checkpoint.save(..., metadata={metric: value}).
+    '''
+    def __init__(
+        self,
+        keep_last=None,
+        keep_every=None,
+        keep_best=None,
+        metric=None,
+        mode="min",
+    ):
+        if keep_best and not metric:
+            raise ValueError("keep_best needs the metric to compare checkpoints by")
+
+        if mode not in ("min", "max"):
+            raise ValueError(f"mode can be min or max, got {mode}")
+
+        self.keep_last  = keep_last
+        self.keep_every = keep_every
+        self.keep_best  = keep_best
+        self.metric     = metric
+        self.mode       = mode
+
+    def keep(self, checkpoints):
+        '''
+            checkpoints: (path, metadata) pairs, oldest first
+        '''
+        if not (self.keep_last or self.keep_every or self.keep_best):
+            return {path for path, _ in checkpoints}
+
+        keep = set()
+
+        if self.keep_last:
+            keep.update(path for path, _ in checkpoints[-self.keep_last:])
+
+        if self.keep_every:
+            # positions in checkpoints shift as older ones are pruned
+            keep.update(
+                path for path, metadata in checkpoints
+                if metadata.get("save_index") and metadata["save_index"] % self.keep_every == 0
+            )
+
+        if self.keep_best:
+            scored = [
+                (metadata[self.metric], path) for path, metadata in checkpoints
+                if metadata.get(self.metric) is not None
+            ]
+            scored.sort(key=lambda c: c[0], reverse=self.mode == "max")
+            keep.update(path for _, path in scored[:self.keep_best])
+
+        return keep
+
+def prune_checkpoints(save_dir, policy, current=None):
+    '''
+        Deletes the complete checkpoints of save_dir that policy does not
+        keep, never current. Returns the deleted paths.
+    '''
+    checkpoints = list_checkpoints(save_dir)
+
+    keep = policy.keep(checkpoints)
+    if current is not None:
+        keep.add(Path(current))
+
+    removed = []
+    for path, _ in checkpoints:
+        if path not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+
+    return removed
+
+def next_save_index(save_dir):
+    '''
+        save_index of the next checkpoint of save_dir, one more than the
+        one of its latest checkpoint.
+    '''
+    checkpoints = list_checkpoints(save_dir)
+    if not checkpoints:
+        return 1
+
+    path, metadata = checkpoints[-1]
+    return metadata.get("save_index", len(checkpoints)) + 1
+
+def latest_checkpoint(save_dir):
+    '''
+        Newest complete checkpoint of save_dir, None if there is none.
+    '''
+    checkpoints = list_checkpoints(save_dir)
+    return checkpoints[-1][0] if checkpoints else None
+
+def agreed_latest_checkpoint(save_dir):
+    '''
+        latest_checkpoint of save_dir as rank 0 sees it, broadcast to every
+        rank. Ranks listing save_dir on their own may disagree (node local
+        disks, a stale NFS view, a save or prune of rank 0 in between) and
+        then load different checkpoints or none.
+    '''
+    if not (dist.is_available() and dist.is_initialized()):
+        return latest_checkpoint(save_dir)
+
+    path = [latest_checkpoint(save_dir) if dist.get_rank() == 0 else None]
+    dist.broadcast_object_list(path, src=0)
+
+    return path[0]
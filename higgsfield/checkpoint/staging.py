@@ -0,0 +1,82 @@
+import copy
+
+import torch
+
+from torch.distributed._shard.sharded_tensor import ShardedTensor
+
+
+class PinnedStateDict:
+    '''
+        Host copies of (sharded) state dicts for asynchronous checkpoints.
+
+        stage() copies every tensor of a state dict into page-locked host
+        buffers with non blocking copies on the current stream and returns
+        the copy. The buffers are kept and reused by the next stage() of a
+        state dict with the same layout, so repeated saves allocate host
+        memory once. The caller must not stage again before the previous
+        copy has been written, see Checkpoint.wait().
+    '''
+    def __init__(self):
+        self.buffers = {}
+        self.event   = None
+
+    def stage(self, state_dict):
+        staged = self._stage((), state_dict)
+
+        if torch.cuda.is_available():
+            self.event = torch.cuda.Event()
+            self.event.record()
+
+        return staged
+
+    def synchronize(self):
+        '''
+            Blocks until the copies of the last stage() are done, call it
+            before reading the staged tensors from another thread.
+        '''
+        if self.event is not None:
+            self.event.synchronize()
+            self.event = None
+
+    def _buffer(self, key, tensor):
+        buffer = self.buffers.get(key)
+
+        if buffer is None or buffer.shape != tensor.shape or buffer.dtype != tensor.dtype:
+            buffer = torch.empty(
+                tensor.shape,
+                dtype=tensor.dtype,
+                pin_memory=torch.cuda.is_available(),
+            )
+            self.buffers[key] = buffer
+
+        buffer.copy_(tensor, non_blocking=True)
+        return buffer
+
+    def _sharded_buffer(self, key, tensor):
+        buffer = self.buffers.get(key)
+
+        if buffer is None or [s.metadata for s in buffer.local_shards()] != \
+                             [s.metadata for s in tensor.local_shards()]:
+            # keeps the sharding metadata, local shards are replaced below
+            buffer = tensor.to(device="cpu") if tensor.device.type != "cpu" else copy.deepcopy(tensor)
+            self.buffers[key] = buffer
+
+        for i, (dst, src) in enumerate(zip(buffer.local_shards(), tensor.local_shards())):
+            dst.tensor = self._buffer(key + (i,), src.tensor)
+
+        return buffer
+
+    def _stage(self, key, obj):
+        if isinstance(obj, ShardedTensor):
+            return self._sharded_buffer(key, obj)
+
+        if isinstance(obj, torch.Tensor):
+            return self._buffer(key, obj)
+
+        if isinstance(obj, dict):
+            return {k: self._stage(key + (k,), v) for k, v in obj.items()}
+
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._stage(key + (i,), v) for i, v in enumerate(obj))
+
+        return copy.deepcopy(obj)
@@ -4,4 +4,14 @@ from .dataset import (
     TorchMultiTurnDataset, 
     TorchCompletionDataset, 
     TorchLMDataset,
-)
\ No newline at end of file
+    TorchUnpaddedDataset,
+)
+from .mmap import (
+    compile_dataset,
+    TorchMMapDataset,
+)
+from .packing import TorchPackedDataset
+from .streaming import (
+    StreamingDataset,
+    TorchStreamingDataset,
+)
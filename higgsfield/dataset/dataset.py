@@ -2,6 +2,84 @@ import copy
 import torch
 from torch.utils.data import Dataset
 
+IGNORE_INDEX = -100  # The default setting in CrossEntropyLoss
+
+def pad_example(example, labels, max_sequence_length):
+    '''
+        example: 1d int64 tensor of token ids
+        labels:  1d int64 tensor, negative values are not trained on
+        
+        Pads (or truncates) both to max_sequence_length and builds the
+        attention mask, the same way every Torch*Dataset does.
+    '''
+    padding = max_sequence_length - example.shape[0]
+    if padding > 0:
+        example = torch.cat((example, torch.zeros(padding, dtype=torch.int64) - 1))
+        labels  = torch.cat((labels,  torch.zeros(padding, dtype=torch.int64) - 1))
+    elif padding < 0:
+        example = example[: max_sequence_length]
+        labels  = labels[:  max_sequence_length]
+    
+    label_mask = labels.ge(0)
+    labels[~label_mask] = IGNORE_INDEX
+    
+    example_mask = example.ge(0)
+    example[~example_mask] = 0
+    example_mask = example_mask.float()
+    
+    return {
+        "input_ids": example,
+        "labels": labels,
+        "attention_mask": example_mask,
+    }
+
+def encode_completions(tokenizer, items, single_pass=False):
+    '''
+        Tokenizes {"prompt", "completion"} items the way TorchCompletionDataset
+        does: prompt + completion followed by eos, where the prompt tokens are
+        not trained on. Returns a list of (token_ids, prompt_length).
+        
+        The prompt length is the number of tokens of the prompt encoded on
+        its own. Prompts and prompt + completion texts are encoded in one
+        batched call each.
+        
+        single_pass: fast tokenizers only encode prompt + completion and take
+            the prompt length from the offsets mapping, the first token that
+            starts inside the completion. A token spanning the boundary, e.g.
+            the prompt's trailing space merged into the first word of the
+            completion, then counts as prompt, while the prompt encoded on
+            its own ends with the space as a token of its own. Labels can
+            differ by a token at the boundary, so it is opt-in.
+    '''
+    prompts = [item["prompt"] for item in items]
+    texts   = [item["prompt"] + item["completion"] for item in items]
+    
+    if not (single_pass and getattr(tokenizer, "is_fast", False)):
+        prompt_ids  = tokenizer(prompts)["input_ids"]
+        example_ids = tokenizer(texts)["input_ids"]
+        
+        return [
+            (example + [tokenizer.eos_token_id], len(prompt))
+            for prompt, example in zip(prompt_ids, example_ids)
+        ]
+    
+    encoded = tokenizer(texts, return_offsets_mapping=True)
+    
+    results = []
+    for prompt, example, offsets in zip(prompts, encoded["input_ids"], encoded["offset_mapping"]):
+        prompt_end = len(prompt)
+        
+        # first real (non special) token that starts inside the completion
+        prompt_length = len(example)
+        for i, (start, end) in enumerate(offsets):
+            if start >= prompt_end and end > start:
+                prompt_length = i
+                break
+        
+        results.append((example + [tokenizer.eos_token_id], prompt_length))
+    
+    return results
+
 class CompletionDataset(Dataset):
     '''
     def __getitem__(self, idx):
@@ -22,37 +100,30 @@ class LMDataset(Dataset):
     pass
 
 class TorchMultiTurnDataset(Dataset):
-    def __init__(self, dataset, tokenizer, max_sequence_length):
+    def __init__(self, dataset, tokenizer, max_sequence_length, single_pass=False):
+        '''
+            single_pass: see encode_completions
+        '''
         self.dataset             = dataset
         self.tokenizer           = tokenizer
         self.max_sequence_length = max_sequence_length
+        self.single_pass         = single_pass
     
     def __len__(self):
         return len(self.dataset)
     
-    def __getitem__(self, idx):
+    def tokenize(self, idx):
         items = self.dataset[idx]
         
-        IGNORE_INDEX = -100
-        
         multi_labels  = []
         multi_example = []
-        for item in items:
-            prompt     = item["prompt"]
-            completion = item["completion"]
-            
-            example = prompt + completion
-            prompt = torch.tensor(
-                self.tokenizer.encode(prompt), dtype=torch.int64
-            )
-            example = self.tokenizer.encode(example)
-            example.append(self.tokenizer.eos_token_id)
+        for example, prompt_length in encode_completions(self.tokenizer, items, self.single_pass):
             example = torch.tensor(
                 example, dtype=torch.int64
             )
-                
+            
             labels = copy.deepcopy(example)
-            labels[: len(prompt)] = -1
+            labels[: prompt_length] = -1
             
             multi_example.append(example)
             multi_labels.append(labels)
@@ -60,73 +131,39 @@ class TorchMultiTurnDataset(Dataset):
         example = torch.cat(multi_example)
         labels  = torch.cat(multi_labels)
         
-        padding = self.max_sequence_length - example.shape[0]
-        if padding > 0:
-            example = torch.cat((example, torch.zeros(padding, dtype=torch.int64) - 1))
-            labels  = torch.cat((labels,  torch.zeros(padding, dtype=torch.int64) - 1))
-        elif padding < 0:
-            example = example[: self.max_sequence_length]
-            labels  = labels[:  self.max_sequence_length]
-        
-        label_mask = labels.ge(0)
-        labels[~label_mask] = IGNORE_INDEX
-        
-        example_mask = example.ge(0)
-        example[~example_mask] = 0
-        example_mask = example_mask.float()
-        
-        return {
-            "input_ids": example,
-            "labels": labels,
-            "attention_mask": example_mask,
-        }
+        return example, labels
+    
+    def __getitem__(self, idx):
+        return pad_example(*self.tokenize(idx), self.max_sequence_length)
 
 class TorchCompletionDataset(Dataset):
-    def __init__(self, dataset, tokenizer, max_sequence_length):
+    def __init__(self, dataset, tokenizer, max_sequence_length, single_pass=False):
+        '''
+            single_pass: see encode_completions
+        '''
         self.dataset             = dataset
         self.tokenizer           = tokenizer
         self.max_sequence_length = max_sequence_length
+        self.single_pass         = single_pass
         
     def __len__(self):
         return len(self.dataset)
         
-    def __getitem__(self, idx):
+    def tokenize(self, idx):
         item = self.dataset[idx]
         
-        prompt = item["prompt"]
-        completion = item["completion"]
-        
-        IGNORE_INDEX = -100  # The default setting in CrossEntropyLoss
-        
-        example = prompt + completion
-        prompt = torch.tensor(
-            self.tokenizer.encode(prompt), dtype=torch.int64
-        )
-        example = self.tokenizer.encode(example)
-        example.append(self.tokenizer.eos_token_id)
+        [(example, prompt_length)] = encode_completions(self.tokenizer, [item], self.single_pass)
         example = torch.tensor(
             example, dtype=torch.int64
         )
-        padding = self.max_sequence_length - example.shape[0]
-        if padding > 0:
-            example = torch.cat((example, torch.zeros(padding, dtype=torch.int64) - 1))
-        elif padding < 0:
-            example = example[: self.max_sequence_length]
-            
-        labels = copy.deepcopy(example)
-        labels[: len(prompt)] = -1
-        label_mask = labels.ge(0)
-        labels[~label_mask] = IGNORE_INDEX
         
-        example_mask = example.ge(0)
-        example[~example_mask] = 0
-        example_mask = example_mask.float()
+        labels = copy.deepcopy(example)
+        labels[: prompt_length] = -1
         
-        return {
-            "input_ids": example,
-            "labels": labels,
-            "attention_mask":example_mask,
-        }
+        return example, labels
+    
+    def __getitem__(self, idx):
+        return pad_example(*self.tokenize(idx), self.max_sequence_length)
 
 class TorchLMDataset(Dataset):
     def __init__(self, dataset, tokenizer, max_sequence_length):
@@ -137,34 +174,44 @@ class TorchLMDataset(Dataset):
     def __len__(self):
         return len(self.dataset)
     
-    def __getitem__(self, idx):
+    def tokenize(self, idx):
         x = self.dataset[idx]
         
-        IGNORE_INDEX = -100
-        
         example = self.tokenizer.encode(x, add_special_tokens=False)
         example = torch.tensor(
             example, dtype=torch.int64
         )
-        
-        padding = self.max_sequence_length - example.shape[0]
-        if padding > 0:
-            example = torch.cat((example, torch.zeros(padding, dtype=torch.int64) - 1))
-        elif padding < 0:
-            example = example[: self.max_sequence_length]
-       
         labels = copy.deepcopy(example)
-        example_mask = example.ge(0)
-        label_mask = labels.ge(0)
-        example[~example_mask] = 0
-        labels[~label_mask] = IGNORE_INDEX
-        example_mask = example_mask.float()
-        label_mask = label_mask.float()       
+        
+        return example, labels
+    
+    def __getitem__(self, idx):
+        return pad_example(*self.tokenize(idx), self.max_sequence_length)
+
+class TorchUnpaddedDataset(Dataset):
+    '''
+        Serves the samples of a Torch*Dataset truncated to max_sequence_length
+        but not padded, so a collator can pad every batch to its own longest
+        sample.
+    '''
+    def __init__(self, dataset, max_sequence_length):
+        self.dataset             = dataset
+        self.max_sequence_length = max_sequence_length
+    
+    def __len__(self):
+        return len(self.dataset)
+    
+    def tokenize(self, idx):
+        return self.dataset.tokenize(idx)
+    
+    def __getitem__(self, idx):
+        example, labels = self.tokenize(idx)
+        
+        example = example[: self.max_sequence_length]
+        labels  = labels[:  self.max_sequence_length]
+        labels[labels < 0] = IGNORE_INDEX
         
         return {
             "input_ids": example,
             "labels": labels,
-            "attention_mask":example_mask,
         }
-        
-        
\ No newline at end of file
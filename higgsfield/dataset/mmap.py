@@ -0,0 +1,204 @@
+import os
+import json
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Dataset
+
+from .dataset import (
+    pad_example,
+    encode_completions,
+)
+
+TOKENS_FILE = "tokens.bin"
+INDEX_FILE  = "index.npy"
+META_FILE   = "meta.json"
+
+def _token_dtype(tokenizer):
+    if len(tokenizer) <= np.iinfo(np.uint16).max + 1:
+        return np.uint16
+    return np.int32
+
+def tokenize_item(item, tokenizer):
+    '''
+        Tokenizes a single CompletionDataset or LMDataset item exactly like
+        TorchCompletionDataset / TorchLMDataset do.
+
+        Returns (token_ids, prompt_length).
+    '''
+    if isinstance(item, str):
+        return tokenizer.encode(item, add_special_tokens=False), 0
+
+    return encode_completions(tokenizer, [item])[0]
+
+def tokenize_batch(items, tokenizer):
+    '''
+        Batched equivalent of tokenize_item, one tokenizer call per field for
+        the whole batch (fast tokenizers encode it in parallel natively).
+    '''
+    if not items:
+        return []
+
+    if isinstance(items[0], str):
+        input_ids = tokenizer(items, add_special_tokens=False)["input_ids"]
+        return [(example, 0) for example in input_ids]
+
+    return encode_completions(tokenizer, items)
+
+_worker_tokenizer = None
+
+def _init_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+def _tokenize_in_worker(items):
+    return tokenize_batch(items, _worker_tokenizer)
+
+def tokenize_dataset(dataset, tokenizer, batch_size=1000, num_proc=1):
+    '''
+        Yields (token_ids, prompt_length) for every sample of a
+        CompletionDataset or LMDataset in order. Samples are tokenized
+        batch_size at a time, spread over num_proc processes.
+    '''
+    def batches():
+        for start in range(0, len(dataset), batch_size):
+            end = min(start + batch_size, len(dataset))
+            yield [dataset[idx] for idx in range(start, end)]
+
+    if num_proc <= 1:
+        for items in batches():
+            yield from tokenize_batch(items, tokenizer)
+        return
+
+    with ProcessPoolExecutor(
+        num_proc,
+        initializer=_init_worker,
+        initargs=(tokenizer,),
+    ) as executor:
+        # keep a bounded number of batches in flight
+        in_flight = []
+        for items in batches():
+            in_flight.append(executor.submit(_tokenize_in_worker, items))
+
+            if len(in_flight) >= 2 * num_proc:
+                yield from in_flight.pop(0).result()
+
+        for future in in_flight:
+            yield from future.result()
+
+def compile_dataset(
+    dataset,
+    tokenizer,
+    path,
+    overwrite=False,
+    batch_size=1000,
+    num_proc=1,
+):
+    '''
+        One-time offline tokenization of a CompletionDataset or LMDataset into
+            {path}/tokens.bin  - every sample's token ids, back to back
+            {path}/index.npy   - [num_samples, 3] of (start, end, prompt_length)
+            {path}/meta.json   - written last, marks the store as complete
+
+        Under torch.distributed only local rank 0 of every node compiles,
+        the other ranks wait on a barrier and reuse the same files.
+        
+        Tokenization runs batch_size samples per tokenizer call on num_proc
+        processes, pass a fast tokenizer to get the most out of it.
+    '''
+    path = Path(path)
+
+    distributed = dist.is_available() and dist.is_initialized()
+    local_rank  = int(os.environ.get("LOCAL_RANK", 0))
+
+    if local_rank == 0 and (overwrite or not (path / META_FILE).exists()):
+        path.mkdir(exist_ok=True, parents=True)
+        (path / META_FILE).unlink(missing_ok=True)
+
+        dtype = _token_dtype(tokenizer)
+        index = np.zeros((len(dataset), 3), dtype=np.int64)
+
+        offset = 0
+        with open(path / TOKENS_FILE, "wb") as tokens_file:
+            tokenized = tokenize_dataset(
+                dataset,
+                tokenizer,
+                batch_size=batch_size,
+                num_proc=num_proc,
+            )
+            for idx, (example, prompt_length) in enumerate(tokenized):
+                tokens_file.write(np.asarray(example, dtype=dtype).tobytes())
+
+                index[idx] = (offset, offset + len(example), prompt_length)
+                offset += len(example)
+
+        np.save(path / INDEX_FILE, index)
+
+        with open(path / META_FILE, "w") as jsonFile:
+            json.dump({
+                "num_samples": len(dataset),
+                "num_tokens": offset,
+                "dtype": np.dtype(dtype).name,
+            }, jsonFile)
+
+    if distributed:
+        dist.barrier()
+
+    return path
+
+class TorchMMapDataset(Dataset):
+    '''
+        Serves samples of a store built by compile_dataset by slicing a
+        read-only memory map, no tokenizer calls. Every process opening the
+        same store shares the kernel page cache.
+    '''
+    def __init__(self, path, max_sequence_length):
+        self.path = Path(path)
+        self.max_sequence_length = max_sequence_length
+
+        with open(self.path / META_FILE) as jsonFile:
+            self.meta = json.load(jsonFile)
+
+        self.index = np.load(self.path / INDEX_FILE, mmap_mode="r")
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        # opened lazily, so DataLoader workers map the file themselves
+        # instead of receiving a pickled copy of it
+        if self._tokens is None:
+            self._tokens = np.memmap(
+                self.path / TOKENS_FILE,
+                dtype=np.dtype(self.meta["dtype"]),
+                mode="r",
+                shape=(self.meta["num_tokens"],),
+            )
+        return self._tokens
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tokens"] = None
+        return state
+
+    def __len__(self):
+        return self.meta["num_samples"]
+
+    def lengths(self):
+        return self.index[:, 1] - self.index[:, 0]
+
+    def tokenize(self, idx):
+        start, end, prompt_length = self.index[idx]
+
+        example = torch.from_numpy(
+            self.tokens[start:end].astype(np.int64)
+        )
+        labels = example.clone()
+        labels[: prompt_length] = -1
+
+        return example, labels
+
+    def __getitem__(self, idx):
+        return pad_example(*self.tokenize(idx), self.max_sequence_length)
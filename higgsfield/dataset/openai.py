@@ -10,6 +10,19 @@ def chat_to_prompt(chat):
     
     return prompt
 
+def chat_turn_to_prompt(messages, first):
+    '''
+        What chat_to_prompt adds for the messages since the last assistant
+        message, first is True if there is none. Concatenating every turn's
+        prompt and completion gives chat_to_prompt of the whole chat.
+    '''
+    prompt = chat_to_prompt(messages)
+    
+    if first or not messages:
+        return prompt
+    
+    return "\n" + prompt
+
 class ChatCompletionDataset(CompletionDataset):
     ''' OpenAI's api format:
     chats = [
@@ -58,4 +71,53 @@ class ChatCompletionDataset(CompletionDataset):
         return {
             "prompt": prompt,
             "completion": completion
-        }
\ No newline at end of file
+        }
+
+class ChatMultiTurnDataset(CompletionDataset):
+    ''' Same chats as ChatCompletionDataset, but one item per chat for
+    TorchMultiTurnDataset instead of one item per assistant message.
+    
+    The prompt of every turn only holds the messages since the previous
+    assistant message, rendered by chat_turn_to_prompt, so every message is
+    rendered and tokenized once and preparing a chat is linear in its length
+    instead of quadratic.
+    '''
+    def __init__(self, chats, chat_turn_to_prompt=chat_turn_to_prompt):
+        self.chat_turn_to_prompt = chat_turn_to_prompt
+        
+        self.chats = chats
+        
+        items = []
+        for chat in self.chats:
+            new_messages = []
+            last_user = False
+            
+            turns = []
+            for message in chat:
+                if message["role"] == "system":
+                    new_messages.append(message)
+                    
+                elif message["role"] == "user":
+                    last_user = True
+                    new_messages.append(message)
+                    
+                elif message["role"] == "assistant":
+                    if last_user:
+                        turns.append({
+                            "prompt": self.chat_turn_to_prompt(new_messages, not turns),
+                            "completion": message["content"],
+                        })
+                        new_messages = []
+                    else:
+                        new_messages.append(message)
+                    
+            if turns:
+                items.append(turns)
+                    
+        self.items = items
+        
+    def __len__(self):
+        return len(self.items)
+        
+    def __getitem__(self, idx):
+        return self.items[idx]
@@ -0,0 +1,122 @@
+from bisect import bisect_left, insort
+
+import torch
+from torch.utils.data import Dataset
+
+from .dataset import IGNORE_INDEX
+
+def dataset_lengths(dataset):
+    '''
+        Unpadded token length of every sample of a Torch*Dataset.
+        Pre-tokenized datasets answer from their index, the rest are
+        tokenized once.
+    '''
+    if hasattr(dataset, "lengths"):
+        return [int(length) for length in dataset.lengths()]
+
+    return [len(dataset.tokenize(idx)[0]) for idx in range(len(dataset))]
+
+def pack_lengths(lengths, max_sequence_length):
+    '''
+        Best-fit decreasing bin packing. Returns a list of rows, each row is
+        a list of sample indices whose lengths sum to at most
+        max_sequence_length (longer samples get a row of their own and are
+        truncated).
+    '''
+    order = sorted(range(len(lengths)), key=lambda idx: (-lengths[idx], idx))
+
+    rows = []
+    free = [] # sorted (remaining capacity, row) pairs
+    for idx in order:
+        length = min(lengths[idx], max_sequence_length)
+
+        pos = bisect_left(free, (length, -1))
+        if pos < len(free):
+            remaining, row = free.pop(pos)
+            rows[row].append(idx)
+        else:
+            remaining, row = max_sequence_length, len(rows)
+            rows.append([idx])
+
+        remaining -= length
+        if remaining > 0:
+            insort(free, (remaining, row))
+
+    return rows
+
+class TorchPackedDataset(Dataset):
+    '''
+        Packs several tokenized examples of a Torch*Dataset into every
+        max_sequence_length row.
+
+        Labels stay masked per example and the first label of every example
+        is ignored, so no token is trained to predict the next document.
+        position_ids restart at 0 for every example.
+
+        block_diagonal_attention: every row gets a boolean [1, L, L] causal
+            mask that only lets tokens attend inside their own example, as
+            sdpa attention takes it. Without it tokens attend across the
+            examples of a row, unless the model runs flash_attention_2,
+            which finds the example boundaries from position_ids.
+    '''
+    def __init__(self, dataset, max_sequence_length, block_diagonal_attention=True):
+        self.dataset = dataset
+        self.max_sequence_length = max_sequence_length
+        self.block_diagonal_attention = block_diagonal_attention
+
+        self.lengths = dataset_lengths(dataset)
+        self.rows    = pack_lengths(self.lengths, max_sequence_length)
+
+    @property
+    def packing_efficiency(self):
+        '''
+            Share of non-padding tokens over all packed rows.
+        '''
+        if not self.rows:
+            return 0.0
+
+        tokens = sum(min(length, self.max_sequence_length) for length in self.lengths)
+        return tokens / (len(self.rows) * self.max_sequence_length)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        L = self.max_sequence_length
+
+        input_ids    = torch.zeros(L, dtype=torch.int64)
+        labels       = torch.full((L,), IGNORE_INDEX, dtype=torch.int64)
+        position_ids = torch.zeros(L, dtype=torch.int64)
+        document_ids = torch.full((L,), -1, dtype=torch.int64)
+
+        offset = 0
+        for document, sample in enumerate(self.rows[idx]):
+            example, example_labels = self.dataset.tokenize(sample)
+
+            length = min(len(example), L - offset)
+            end = offset + length
+
+            input_ids[offset:end] = example[:length]
+            labels[offset:end] = example_labels[:length]
+            labels[offset:offset + 1] = -1
+            position_ids[offset:end] = torch.arange(length)
+            document_ids[offset:end] = document
+
+            offset = end
+
+        # padding tail is a segment of its own
+        position_ids[offset:] = torch.arange(L - offset)
+        labels[labels < 0] = IGNORE_INDEX
+
+        item = {
+            "input_ids": input_ids,
+            "labels": labels,
+            "position_ids": position_ids,
+        }
+
+        if self.block_diagonal_attention:
+            same_document = document_ids.unsqueeze(0) == document_ids.unsqueeze(1)
+            causal = torch.ones(L, L, dtype=torch.bool).tril()
+            item["attention_mask"] = (same_document & causal).unsqueeze(0)
+
+        return item
@@ -0,0 +1,295 @@
+import json
+import random
+import itertools
+from pathlib import Path
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import (
+    IterableDataset,
+    get_worker_info,
+)
+
+from .dataset import (
+    pad_example,
+    encode_completions,
+)
+
+SHARD_SUFFIXES = (".jsonl", ".parquet")
+
+def _shard_paths(paths):
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+
+    shards = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            shards.extend(sorted(
+                p for p in path.iterdir() if p.suffix in SHARD_SUFFIXES
+            ))
+        else:
+            shards.append(path)
+
+    return shards
+
+def _jsonl_units(path, unit_bytes):
+    # newline scan only, records are not parsed
+    units = []
+    start, offset, count = 0, 0, 0
+    with open(path, "rb") as f:
+        for line in f:
+            offset += len(line)
+            if line.strip():
+                count += 1
+
+            if offset - start >= unit_bytes:
+                units.append((str(path), start, offset, count))
+                start, count = offset, 0
+
+    if count:
+        units.append((str(path), start, offset, count))
+
+    return units
+
+def _parquet_file(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading parquet shards requires pyarrow: pip install pyarrow")
+
+    return pq.ParquetFile(path)
+
+def _parquet_units(path):
+    # row counts come from the footer, no row group is read
+    metadata = _parquet_file(path).metadata
+    return [
+        (str(path), i, None, metadata.row_group(i).num_rows)
+        for i in range(metadata.num_row_groups)
+    ]
+
+def _read_jsonl(path, start, end, skip, take):
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+
+        for line in f:
+            if offset >= end or take == 0:
+                return
+            offset += len(line)
+
+            if not line.strip():
+                continue
+            if skip:
+                skip -= 1
+                continue
+
+            take -= 1
+            yield json.loads(line)
+
+def _read_parquet(path, row_group, skip, take):
+    table = _parquet_file(path).read_row_group(row_group)
+    yield from table.slice(skip, take).to_pylist()
+
+def _dist_info():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+class StreamingDataset(IterableDataset):
+    '''
+        Iterable counterpart of CompletionDataset / LMDataset that streams
+        records from local JSONL or Parquet shards with constant memory.
+
+        paths: shard files or directories holding them.
+        transform: maps a record to an item, {"prompt", "completion"} dict
+            for completion data or a string for language modeling. By
+            default records are used as they are, or record[text_key] when
+            text_key is given.
+        unit_bytes: JSONL shards are split into byte ranges of about this
+            size ending at line ends, Parquet shards into their row groups.
+
+        On creation the ranks index the shards between them: the record
+        count of every unit, from a newline scan for JSONL and from the
+        footer for Parquet. Every epoch the units are put in a (shuffled)
+        order and every DataLoader worker of every rank reads only its
+        contiguous share of the records, the units overlapping it, so the
+        data is read and decoded once per epoch. Shares are equal, the
+        last len % (world_size * num_workers) records are dropped. With
+        shuffle, samples also go through a shuffle buffer of buffer_size
+        records per worker.
+    '''
+    def __init__(
+        self,
+        paths,
+        transform=None,
+        text_key=None,
+        shuffle=True,
+        buffer_size=10000,
+        seed=0,
+        unit_bytes=64 * 2**20,
+    ):
+        self.paths       = _shard_paths(paths)
+        self.transform   = transform
+        self.text_key    = text_key
+        self.shuffle     = shuffle
+        self.buffer_size = buffer_size
+        self.seed        = seed
+        self.unit_bytes  = unit_bytes
+        self.epoch       = 0
+        
+        # rotates which DataLoader worker reads which share of the records,
+        # see TorchStreamingDataset.skip_batches
+        self.worker_shift = 0
+
+        if not self.paths:
+            raise ValueError(f"No {' or '.join(SHARD_SUFFIXES)} shards found in {paths}")
+
+        # DataLoader workers may not see the process group
+        self.rank, self.world_size = _dist_info()
+
+        self.units = self._index()
+
+    def _index(self):
+        '''
+            (path, start, end, records) of every unit in shard order, a
+            row group index as start and no end for Parquet. Every rank
+            scans its round robin share of the shards.
+        '''
+        units = {}
+        for i in range(self.rank, len(self.paths), self.world_size):
+            path = self.paths[i]
+            if path.suffix == ".parquet":
+                units[i] = _parquet_units(path)
+            else:
+                units[i] = _jsonl_units(path, self.unit_bytes)
+
+        if self.world_size > 1:
+            gathered = [None] * self.world_size
+            dist.all_gather_object(gathered, units)
+            units = {i: u for rank_units in gathered for i, u in rank_units.items()}
+
+        return [unit for i in range(len(self.paths)) for unit in units[i]]
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _worker(self):
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info else (0, 1)
+        worker_id = (worker_id + self.worker_shift) % num_workers
+
+        return self.rank * num_workers + worker_id, self.world_size * num_workers
+
+    def _to_item(self, record):
+        if self.transform:
+            return self.transform(record)
+        if self.text_key:
+            return record[self.text_key]
+        return record
+
+    def records(self):
+        '''
+            This worker's share of the records of the epoch, read from the
+            units overlapping it only.
+        '''
+        worker, num_workers = self._worker()
+
+        units = list(self.units)
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(units)
+
+        share = sum(unit[3] for unit in units) // num_workers
+        begin, end = worker * share, (worker + 1) * share
+
+        offset = 0
+        for path, start, stop, count in units:
+            first, offset = offset, offset + count
+            if offset <= begin:
+                continue
+            if first >= end:
+                break
+
+            skip = max(begin - first, 0)
+            take = min(end, offset) - first - skip
+
+            if stop is None:
+                yield from _read_parquet(path, start, skip, take)
+            else:
+                yield from _read_jsonl(path, start, stop, skip, take)
+
+    def __iter__(self):
+        worker, _ = self._worker()
+        rng = random.Random(self.seed + self.epoch * 7919 + worker)
+
+        items = map(self._to_item, self.records())
+
+        if not self.shuffle:
+            yield from items
+            return
+
+        buffer = []
+        for item in items:
+            if len(buffer) < self.buffer_size:
+                buffer.append(item)
+                continue
+
+            idx = rng.randrange(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = item
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+class TorchStreamingDataset(IterableDataset):
+    '''
+        Tokenizes and pads the items of a StreamingDataset like
+        TorchCompletionDataset (dict items) or TorchLMDataset (str items).
+    '''
+    def __init__(self, dataset, tokenizer, max_sequence_length):
+        self.dataset             = dataset
+        self.tokenizer           = tokenizer
+        self.max_sequence_length = max_sequence_length
+        
+        self.resume_batches    = 0
+        self.resume_batch_size = 1
+
+    def set_epoch(self, epoch):
+        self.dataset.set_epoch(epoch)
+
+    def skip_batches(self, batches, batch_size):
+        '''
+            Skips the first batches of the next epoch. DataLoader takes
+            batches from its workers round robin starting at worker 0, so
+            workers are rotated to make worker 0 read the share of the worker
+            that produced the next batch, and every worker drops its already
+            consumed items before tokenizing them.
+        '''
+        self.resume_batches       = batches
+        self.resume_batch_size    = batch_size
+        self.dataset.worker_shift = batches
+
+    def _skipped_items(self):
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info else (0, 1)
+        worker_id = (worker_id + self.resume_batches) % num_workers
+
+        batches = (self.resume_batches - worker_id + num_workers - 1) // num_workers
+        return max(batches, 0) * self.resume_batch_size
+
+    def tokenize(self, item):
+        if isinstance(item, str):
+            example = self.tokenizer.encode(item, add_special_tokens=False)
+            prompt_length = 0
+        else:
+            [(example, prompt_length)] = encode_completions(self.tokenizer, [item])
+
+        example = torch.tensor(example, dtype=torch.int64)
+        labels = example.clone()
+        labels[: prompt_length] = -1
+
+        return example, labels
+
+    def __iter__(self):
+        items = itertools.islice(self.dataset, self._skipped_items(), None)
+        for item in items:
+            yield pad_example(*self.tokenize(item), self.max_sequence_length)
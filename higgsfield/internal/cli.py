@@ -112,6 +112,24 @@ def show_deploy_key():
         click.echo(f.read_text() + "\n")
 
 
+@click.command("consolidate-checkpoint")
+@click.argument("checkpoint_path", type=str, required=True)
+@click.argument("model_name", type=str, required=True)
+@click.argument("save_path", type=str, required=True)
+@click.option("--model_type", type=click.Choice(["llama", "mistral"]), default="llama", help="model type")
+def consolidate_checkpoint(
+    checkpoint_path: str,
+    model_name: str,
+    save_path: str,
+    model_type: str,
+):
+    """Merge a sharded checkpoint into a huggingface model"""
+    from higgsfield.checkpoint.consolidate import consolidate_sharded_checkpoint
+
+    consolidate_sharded_checkpoint(checkpoint_path, model_name, save_path, model_type)
+    print(f"Consolidated {checkpoint_path} into {save_path}")
+
+
 @click.group("ci")
 def ci():
     pass
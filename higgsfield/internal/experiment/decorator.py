@@ -51,16 +51,22 @@ class ExperimentDecorator:
             self.params.append(Param.from_values(name="seed", default=seed, type=int))
         else:
             self.params.append(Param.from_values(name="seed", type=int, required=True, default=42))
+        # reserved, see higgsfield.profiling.parse_profile
+        self.params.append(Param.from_values(
+            name="profile",
+            type=str,
+            default="none",
+            description="torch.profiler window, e.g. wait=10,warmup=2,active=3",
+        ))
         self.train = lambda x: print("this shouldn't have been called at all")
 
     def __call__(self, func: Callable[..., None]) -> Optional[Callable[..., None]] :
         if type(func) == InnerWrap:
-            # check if seed is in params:
-            if not any(param.name == "seed" for param in func.param_set):
-                # add seed param
-                self.params.extend(list(func.param_set))
-            else:
-                self.params = list(func.param_set)
+            # keep the reserved params (seed, profile) the experiment
+            # doesn't define itself
+            names = {param.name for param in func.param_set}
+            self.params = [param for param in self.params if param.name not in names]
+            self.params.extend(list(func.param_set))
             self.train = func.func
 
             return
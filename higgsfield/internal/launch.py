@@ -50,7 +50,7 @@ class Launch:
         for arg in rest:
             if "=" not in arg:
                 continue
-            key, value = arg.split("=")
+            key, value = arg.split("=", 1)
             kwargs[key] = value
         return kwargs
 
@@ -71,8 +71,43 @@ class Launch:
         setattr(params, "rank", int(os.environ.get("RANK", 0)))
         setattr(params, "world_size", int(os.environ.get("WORLD_SIZE", 1)))
         setattr(params, "local_rank", int(os.environ.get("LOCAL_RANK", 0)))
+        setattr(params, "resume_from", self._latest_checkpoint())
 
         self.prepared = params
 
+    def _latest_checkpoint(self):
+        # a restarted run (preemption, max_repeats) finds the checkpoints of
+        # the same run name, see Checkpoint.resume
+        from higgsfield.checkpoint.retention import agreed_latest_checkpoint
+
+        path = agreed_latest_checkpoint(
+            Path.home()
+            / ".cache"
+            / "higgsfield"
+            / self.project_name
+            / "experiments"
+            / self.experiment_name
+            / self.run_name
+        )
+
+        if path is not None and int(os.environ.get("RANK", 0)) == 0:
+            print(f"Run {self.run_name} has a checkpoint to resume from: {path}")
+
+        return path
+
     def apply_train(self):
-        self.experiment.train(self.prepared)
+        # profile=... of the run wraps the training in torch.profiler,
+        # traces of every rank go to the run's profiles directory
+        from higgsfield.profiling import profile
+        from higgsfield.path import ProjectCachePath
+
+        spec = getattr(self.prepared, "profile", None)
+        trace_dir = None
+        if spec and spec != "none":
+            trace_dir = ProjectCachePath(self.project_name) \
+                .experiment_path(self.experiment_name) \
+                .run_path(self.run_name) \
+                .profile_path()
+
+        with profile(spec, trace_dir, rank=self.prepared.rank):
+            self.experiment.train(self.prepared)
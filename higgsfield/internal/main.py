@@ -6,6 +6,7 @@ from higgsfield.internal.cli import (
     run_experiment,
     show_deploy_key,
     build_experiments,
+    consolidate_checkpoint,
     ci_cli,
 )
 
@@ -21,4 +22,5 @@ cli.add_command(ci)
 cli.add_command(run_experiment)
 cli.add_command(build_experiments)
 cli.add_command(show_deploy_key)
+cli.add_command(consolidate_checkpoint)
 cli.add_command(ci_cli.setup_nodes)
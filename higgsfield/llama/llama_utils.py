@@ -1,17 +1,18 @@
-import torch
 from transformers import (
     LlamaConfig,
     LlamaForCausalLM,
 )
-from higgsfield.checkpoint import fsdp_model_state_dict_rank0
+from higgsfield.checkpoint.mmap_utils import load_model_from_checkpoint
 
 def load_llama_from_config(model_name):
     config = LlamaConfig.from_pretrained(model_name)
     model = LlamaForCausalLM(config)
     return model
 
-def load_llama_from_checkpoint(model_name, checkpoint_path):
-    model = load_llama_from_config(model_name)
-    state_dict = torch.load(checkpoint_path)
-    model.load_state_dict(state_dict)
-    return model
\ No newline at end of file
+def load_llama_from_checkpoint(model_name, checkpoint_path, dtype=None):
+    '''
+        checkpoint_path: model.safetensors or model.pt, memory mapped
+        dtype: parameters dtype, float32 by default
+    '''
+    config = LlamaConfig.from_pretrained(model_name)
+    return load_model_from_checkpoint(LlamaForCausalLM, config, checkpoint_path, dtype=dtype)
@@ -1 +1,3 @@
-from .llama_loader import LlamaLoader
\ No newline at end of file
+from .loader import HiggsfieldSampler, HiggsfieldLoader
+from .llama_loader import LlamaLoader
+from .prefetcher import DevicePrefetcher
@@ -0,0 +1,269 @@
+import math
+
+import torch
+import torch.distributed as dist
+
+from torch.utils.data import Sampler
+
+from higgsfield.dataset.dataset import IGNORE_INDEX
+
+def sort_in_buckets(indices, lengths, bucket_size):
+    '''
+        Sorts indices by length (longest first) inside consecutive buckets
+        of bucket_size, keeping the bucket order.
+    '''
+    sorted_indices = []
+    for start in range(0, len(indices), bucket_size):
+        sorted_indices.extend(sorted(
+            indices[start:start + bucket_size],
+            key=lambda idx: lengths[idx],
+            reverse=True,
+        ))
+    return sorted_indices
+
+class LengthGroupedSampler(Sampler):
+    '''
+        Distributed batch sampler that puts samples of similar length into
+        the same step.
+
+        Every epoch the dataset is shuffled with seed + epoch (same order on
+        every rank), cut into buckets of bucket_size global batches, sorted
+        by length inside every bucket and split into global batches of
+        batch_size * world_size samples. Global batches are shuffled again
+        and every rank takes an equal strided share of each one, so all ranks
+        run the same number of steps on similarly long samples.
+    '''
+    def __init__(
+        self,
+        lengths,
+        batch_size,
+        shuffle=True,
+        seed=0,
+        drop_last=False,
+        bucket_size=64,
+    ):
+        self.rank         = dist.get_rank()
+        self.num_replicas = dist.get_world_size()
+
+        self.lengths     = lengths
+        self.batch_size  = batch_size
+        self.shuffle     = shuffle
+        self.seed        = seed
+        self.drop_last   = drop_last
+        self.bucket_size = bucket_size
+        self.epoch       = 0
+        self.start_batch = 0
+
+        self.global_batch_size = batch_size * self.num_replicas
+
+        if drop_last:
+            self.num_batches = len(lengths) // self.global_batch_size
+        else:
+            self.num_batches = math.ceil(len(lengths) / self.global_batch_size)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def global_batches(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+
+        if self.shuffle:
+            indices = torch.randperm(len(self.lengths), generator=g).tolist()
+        else:
+            indices = list(range(len(self.lengths)))
+
+        # repeat samples to make it evenly divisible, like DistributedSampler
+        total_size = self.num_batches * self.global_batch_size
+        if total_size > len(indices):
+            indices = indices * math.ceil(total_size / len(indices))
+        indices = indices[:total_size]
+
+        indices = sort_in_buckets(
+            indices,
+            self.lengths,
+            self.global_batch_size * self.bucket_size,
+        )
+        batches = [
+            indices[offset:offset + self.global_batch_size]
+            for offset in range(0, total_size, self.global_batch_size)
+        ]
+
+        if self.shuffle:
+            order = torch.randperm(len(batches), generator=g).tolist()
+            batches = [batches[idx] for idx in order]
+
+        return batches
+
+    def __iter__(self):
+        for batch in self.global_batches()[self.start_batch:]:
+            yield batch[self.rank::self.num_replicas]
+
+    def __len__(self):
+        return max(self.num_batches - self.start_batch, 0)
+
+    def state_dict(self):
+        return {
+            "epoch": self.epoch,
+            "start_batch": self.start_batch,
+        }
+
+    def load_state_dict(self, state_dict):
+        self.epoch       = state_dict["epoch"]
+        self.start_batch = state_dict["start_batch"]
+
+class TokenBudgetSampler(Sampler):
+    '''
+        Distributed batch sampler that fills every micro-batch up to
+        max_tokens padded tokens (max length in the batch, rounded up to
+        pad_to_multiple_of, times the number of samples) instead of a fixed
+        number of samples.
+
+        Every rank builds the same plan from the same seed and lengths:
+        length-sorted buckets are cut into micro-batches, consecutive
+        micro-batches are grouped world_size at a time into steps, and each
+        rank takes its micro-batch of every step. All ranks therefore run the
+        same number of steps per epoch without any communication. An
+        incomplete last step is dropped with drop_last, otherwise filled with
+        micro-batches from the start of the epoch.
+    '''
+    def __init__(
+        self,
+        lengths,
+        max_tokens,
+        max_sequence_length,
+        pad_to_multiple_of=8,
+        shuffle=True,
+        seed=0,
+        drop_last=False,
+        bucket_size=4096,
+    ):
+        self.rank         = dist.get_rank()
+        self.num_replicas = dist.get_world_size()
+
+        self.lengths             = lengths
+        self.max_tokens          = max_tokens
+        self.max_sequence_length = max_sequence_length
+        self.pad_to_multiple_of  = pad_to_multiple_of
+        self.shuffle             = shuffle
+        self.seed                = seed
+        self.drop_last           = drop_last
+        self.bucket_size         = bucket_size
+        self.epoch               = 0
+        self.start_batch         = 0
+
+        self._plan_epoch = None
+        self._plan       = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def padded_length(self, idx):
+        length = min(self.lengths[idx], self.max_sequence_length)
+        if self.pad_to_multiple_of:
+            length = math.ceil(length / self.pad_to_multiple_of) * self.pad_to_multiple_of
+        return min(length, self.max_sequence_length)
+
+    def micro_batches(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+
+        if self.shuffle:
+            indices = torch.randperm(len(self.lengths), generator=g).tolist()
+        else:
+            indices = list(range(len(self.lengths)))
+
+        indices = sort_in_buckets(indices, self.lengths, self.bucket_size)
+
+        batches = []
+        batch, longest = [], 0
+        for idx in indices:
+            length = self.padded_length(idx)
+            if batch and max(longest, length) * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch, longest = [], 0
+            batch.append(idx)
+            longest = max(longest, length)
+
+        if batch:
+            batches.append(batch)
+
+        return batches, g
+
+    def steps(self):
+        if self._plan_epoch == self.epoch:
+            return self._plan
+
+        batches, g = self.micro_batches()
+
+        remainder = len(batches) % self.num_replicas
+        if remainder and self.drop_last:
+            batches = batches[: len(batches) - remainder]
+        elif remainder:
+            missing = self.num_replicas - remainder
+            batches += (batches * math.ceil(missing / len(batches)))[:missing]
+
+        steps = [
+            batches[offset:offset + self.num_replicas]
+            for offset in range(0, len(batches), self.num_replicas)
+        ]
+
+        if self.shuffle:
+            order = torch.randperm(len(steps), generator=g).tolist()
+            steps = [steps[idx] for idx in order]
+
+        self._plan_epoch = self.epoch
+        self._plan       = steps
+
+        return steps
+
+    def __iter__(self):
+        for step in self.steps()[self.start_batch:]:
+            yield step[self.rank]
+
+    def __len__(self):
+        return max(len(self.steps()) - self.start_batch, 0)
+
+    def state_dict(self):
+        return {
+            "epoch": self.epoch,
+            "start_batch": self.start_batch,
+        }
+
+    def load_state_dict(self, state_dict):
+        self.epoch       = state_dict["epoch"]
+        self.start_batch = state_dict["start_batch"]
+
+class DynamicPaddingCollator:
+    '''
+        Pads a list of unpadded samples (see TorchUnpaddedDataset) only up to
+        the longest one of the batch, rounded up to pad_to_multiple_of and
+        capped at max_sequence_length.
+    '''
+    def __init__(self, max_sequence_length, pad_to_multiple_of=8):
+        self.max_sequence_length = max_sequence_length
+        self.pad_to_multiple_of  = pad_to_multiple_of
+
+    def padded_length(self, length):
+        if self.pad_to_multiple_of:
+            length = math.ceil(length / self.pad_to_multiple_of) * self.pad_to_multiple_of
+        return min(length, self.max_sequence_length)
+
+    def __call__(self, items):
+        length = self.padded_length(max(len(item["input_ids"]) for item in items))
+
+        input_ids      = torch.zeros(len(items), length, dtype=torch.int64)
+        labels         = torch.full((len(items), length), IGNORE_INDEX, dtype=torch.int64)
+        attention_mask = torch.zeros(len(items), length)
+
+        for row, item in enumerate(items):
+            n = len(item["input_ids"])
+            input_ids[row, :n] = item["input_ids"]
+            labels[row, :n] = item["labels"]
+            attention_mask[row, :n] = 1.0
+
+        return {
+            "input_ids": input_ids,
+            "labels": labels,
+            "attention_mask": attention_mask,
+        }
@@ -0,0 +1,259 @@
+import torch.distributed as dist
+
+from torch.utils.data import (
+    DistributedSampler,
+    DataLoader,
+    IterableDataset,
+)
+
+from higgsfield.dataset import (
+    TorchCompletionDataset,
+    TorchMMapDataset,
+    TorchPackedDataset,
+    TorchUnpaddedDataset,
+    StreamingDataset,
+    TorchStreamingDataset,
+)
+from higgsfield.dataset.packing import dataset_lengths
+
+from .bucketing import (
+    LengthGroupedSampler,
+    TokenBudgetSampler,
+    DynamicPaddingCollator,
+)
+
+class HiggsfieldSampler(DistributedSampler):
+    '''
+        DistributedSampler that can start an epoch at start_index, so a
+        resumed run continues at the exact sample it stopped at.
+    '''
+    def __init__(
+        self,
+        dataset,
+        shuffle=True,
+        seed=0,
+        drop_last=False
+    ):
+        rank=dist.get_rank()
+        num_replicas=dist.get_world_size()
+
+        super(HiggsfieldSampler, self).__init__(
+            dataset=dataset,
+            num_replicas=num_replicas,
+            rank=rank,
+            shuffle=shuffle,
+            seed=seed,
+            drop_last=drop_last,
+        )
+        
+        self.start_index = 0
+
+    def __iter__(self):
+        indices = list(super(HiggsfieldSampler, self).__iter__())
+        return iter(indices[self.start_index:])
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+    def state_dict(self):
+        return {
+            "epoch": self.epoch,
+            "start_index": self.start_index,
+        }
+
+    def load_state_dict(self, state_dict):
+        self.epoch       = state_dict["epoch"]
+        self.start_index = state_dict["start_index"]
+
+class HiggsfieldLoader(DataLoader):
+    '''
+        Distributed loader shared by LlamaLoader and MistralLoader.
+
+        packing: concatenate several examples into every max_sequence_length
+            row instead of padding each one (see TorchPackedDataset).
+        
+        dynamic_padding: batch similar-length examples together
+            (see LengthGroupedSampler) and pad every batch only to its
+            longest example, rounded up to pad_to_multiple_of. Examples
+            are sorted by length within buckets of bucket_size global
+            batches.
+        
+        max_tokens_per_gpu: fill every micro-batch up to this many padded
+            tokens instead of batch_size_per_gpu samples (see
+            TokenBudgetSampler), implies dynamic_padding. Examples are
+            sorted by length within buckets of token_bucket_size examples.
+        
+        A StreamingDataset is tokenized on the fly and sharded over ranks and
+        workers by the dataset itself, shuffle and seed are taken from it.
+        
+        state_dict() holds the epoch and the number of batches consumed in
+        it. After load_state_dict() the next iteration starts right after the
+        last consumed batch without loading the skipped samples.
+    '''
+    def __init__(
+        self,
+        dataset,
+        tokenizer,
+        max_sequence_length=2048,
+        batch_size_per_gpu=1,
+        shuffle=True,
+        seed=0,
+        num_workers=0,
+        pin_memory=False,
+        drop_last=False,
+        timeout=0,
+        worker_init_fn=None,
+        multiprocessing_context=None,
+        *,
+        packing=False,
+        block_diagonal_attention=True,
+        dynamic_padding=False,
+        pad_to_multiple_of=8,
+        bucket_size=64,
+        max_tokens_per_gpu=None,
+        token_bucket_size=4096,
+        prefetch_factor=None,
+        persistent_workers=False,
+        pin_memory_device=""
+    ):
+        
+        if max_tokens_per_gpu:
+            dynamic_padding = True
+        
+        if packing and dynamic_padding:
+            raise ValueError("packing and dynamic_padding can't be used together")
+
+        if isinstance(dataset, IterableDataset):
+            if packing or dynamic_padding:
+                raise ValueError("packing and dynamic_padding need a map-style dataset")
+            
+            if isinstance(dataset, StreamingDataset):
+                dataset = TorchStreamingDataset(
+                    dataset,
+                    tokenizer,
+                    max_sequence_length,
+                )
+        
+        elif not isinstance(dataset, TorchMMapDataset):
+            dataset = TorchCompletionDataset(
+                dataset,
+                tokenizer,
+                max_sequence_length,
+            )
+
+        if packing:
+            dataset = TorchPackedDataset(
+                dataset,
+                max_sequence_length,
+                block_diagonal_attention=block_diagonal_attention,
+            )
+
+            if dist.get_rank() == 0:
+                print(f"Packed {len(dataset.lengths)} examples into {len(dataset)} rows")
+                print(f"Packing efficiency = {dataset.packing_efficiency:.4f}\n")
+
+        if max_tokens_per_gpu:
+            batch_sampler = TokenBudgetSampler(
+                dataset_lengths(dataset),
+                max_tokens_per_gpu,
+                max_sequence_length,
+                pad_to_multiple_of=pad_to_multiple_of,
+                shuffle=shuffle,
+                seed=seed,
+                drop_last=drop_last,
+                bucket_size=token_bucket_size,
+            )
+        elif dynamic_padding:
+            batch_sampler = LengthGroupedSampler(
+                dataset_lengths(dataset),
+                batch_size_per_gpu,
+                shuffle=shuffle,
+                seed=seed,
+                drop_last=drop_last,
+                bucket_size=bucket_size,
+            )
+        
+        if isinstance(dataset, IterableDataset):
+            batching = dict(
+                batch_size=batch_size_per_gpu,
+                drop_last=drop_last,
+            )
+        elif dynamic_padding:
+            dataset = TorchUnpaddedDataset(dataset, max_sequence_length)
+            
+            batching = dict(
+                batch_sampler=batch_sampler,
+                collate_fn=DynamicPaddingCollator(
+                    max_sequence_length,
+                    pad_to_multiple_of=pad_to_multiple_of,
+                ),
+            )
+        else:
+            batching = dict(
+                batch_size=batch_size_per_gpu,
+                sampler=HiggsfieldSampler(dataset, shuffle=shuffle, seed=seed,),
+                drop_last=drop_last,
+            )
+        
+        super(HiggsfieldLoader, self).__init__(
+            dataset,
+            num_workers=num_workers,
+            pin_memory=pin_memory,
+            timeout=timeout,
+            worker_init_fn=worker_init_fn,
+            multiprocessing_context=multiprocessing_context,
+            prefetch_factor=prefetch_factor,
+            persistent_workers=persistent_workers,
+            pin_memory_device=pin_memory_device,
+            **batching,
+        )
+        
+        self.epoch = 0
+        self.batches = 0
+        self._resume_batches = 0
+
+    def set_epoch(self, epoch):
+        '''
+            Reshuffles the data for the given epoch, call it before iterating.
+        '''
+        self.epoch = epoch
+        
+        for source in (self.sampler, self.batch_sampler, self.dataset):
+            if hasattr(source, "set_epoch"):
+                source.set_epoch(epoch)
+
+    def _seek(self, batches):
+        if isinstance(self.batch_sampler, (LengthGroupedSampler, TokenBudgetSampler)):
+            self.batch_sampler.start_batch = batches
+        
+        elif isinstance(self.sampler, HiggsfieldSampler):
+            self.sampler.start_index = min(batches * self.batch_size, self.sampler.num_samples)
+        
+        elif isinstance(self.dataset, TorchStreamingDataset):
+            self.dataset.skip_batches(batches, self.batch_size)
+
+    def __iter__(self):
+        self.batches = self._resume_batches
+        self._seek(self._resume_batches)
+        self._resume_batches = 0
+        
+        try:
+            for batch in super(HiggsfieldLoader, self).__iter__():
+                self.batches += 1
+                yield batch
+        finally:
+            self._seek(0)
+
+    def state_dict(self):
+        return {
+            "epoch": self.epoch,
+            "batches": self.batches,
+        }
+
+    def load_state_dict(self, state_dict):
+        self.set_epoch(state_dict["epoch"])
+        self._resume_batches = state_dict["batches"]
+
+    @property
+    def packing_efficiency(self):
+        return getattr(self.dataset, "packing_efficiency", None)
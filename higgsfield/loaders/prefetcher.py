@@ -0,0 +1,120 @@
+import collections
+
+import torch
+
+
+class DevicePrefetcher:
+    '''
+        Wraps a LlamaLoader / MistralLoader and copies its batches to the
+        GPU depth batches ahead, with non-blocking copies from pinned
+        memory on a side stream, so the host to device transfer of the
+        next batches overlaps the compute of the current one. Batches are
+        handed out already on the device, the model skips moving them.
+
+        Tensors not pinned yet are pinned here, pass pin_memory=True to the
+        loader to pin them in its pinning thread instead. On CPU batches
+        are handed out as they come.
+
+        Otherwise it is used like the loader: set_epoch, len and the
+        other attributes are the loader's. batches and state_dict() count
+        only the batches handed out, not the prefetched ones, so it can be
+        passed to Checkpoint as loader.
+
+        train_loader = DevicePrefetcher(LlamaLoader(dataset, pin_memory=True))
+    '''
+    def __init__(self, loader, device=None, depth=2):
+        if device is None:
+            if torch.cuda.is_available():
+                device = torch.device("cuda", torch.cuda.current_device())
+            else:
+                device = torch.device("cpu")
+
+        self.loader  = loader
+        self.device  = torch.device(device)
+        self.depth   = depth
+        self.batches = loader.batches
+
+        if self.device.type == "cuda":
+            self.stream = torch.cuda.Stream(device=self.device)
+        else:
+            self.stream = None
+
+    def __getattr__(self, name):
+        if name == "loader":
+            raise AttributeError(name)
+
+        return getattr(self.loader, name)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _copy(self, batch):
+        '''
+            Issues the copies of batch on the side stream, returns the
+            device batch and an event recorded after the copies.
+        '''
+        if self.stream is None:
+            return batch, None
+
+        copied = {}
+        with torch.cuda.stream(self.stream):
+            for key, value in batch.items():
+                if isinstance(value, torch.Tensor):
+                    if not value.is_pinned():
+                        value = value.pin_memory()
+                    value = value.to(self.device, non_blocking=True)
+                copied[key] = value
+
+            event = torch.cuda.Event()
+            event.record(self.stream)
+
+        return copied, event
+
+    def _ready(self, batch, event):
+        '''
+            Makes the compute stream wait for the copies of batch, and
+            keeps the allocator from reusing its memory while the compute
+            stream still uses it.
+        '''
+        if event is None:
+            return batch
+
+        stream = torch.cuda.current_stream(self.device)
+        stream.wait_event(event)
+
+        for value in batch.values():
+            if isinstance(value, torch.Tensor):
+                value.record_stream(stream)
+
+        return batch
+
+    def __iter__(self):
+        iterator  = iter(self.loader)
+        pending   = collections.deque()
+        lookahead = self.depth if self.stream is not None else 0
+        exhausted = False
+
+        while True:
+            while not exhausted and len(pending) <= lookahead:
+                try:
+                    pending.append(self._copy(next(iterator)))
+                except StopIteration:
+                    exhausted = True
+
+            if not pending:
+                return
+
+            batch, event = pending.popleft()
+            self.batches = self.loader.batches - len(pending)
+
+            yield self._ready(batch, event)
+
+    def state_dict(self):
+        return {
+            "epoch": self.loader.epoch,
+            "batches": self.batches,
+        }
+
+    def load_state_dict(self, state_dict):
+        self.loader.load_state_dict(state_dict)
+        self.batches = state_dict["batches"]
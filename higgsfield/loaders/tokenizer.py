@@ -0,0 +1,20 @@
+LLAMA_TOKENIZER = "meta-llama/Llama-2-7b-hf"
+
+_tokenizers = {}
+
+def cached_tokenizer(key, load):
+    '''
+        Per-process tokenizer cache, load() runs only the first time a key
+        is asked for.
+    '''
+    if key not in _tokenizers:
+        _tokenizers[key] = load()
+    
+    return _tokenizers[key]
+
+def llama_tokenizer(model_name=LLAMA_TOKENIZER):
+    def load():
+        from transformers import LlamaTokenizer
+        return LlamaTokenizer.from_pretrained(model_name)
+    
+    return cached_tokenizer(("llama", model_name), load)
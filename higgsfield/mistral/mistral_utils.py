@@ -1,9 +1,8 @@
-import torch
 from transformers import (
     MistralConfig,
     MistralForCausalLM,
 )
-from higgsfield.checkpoint import fsdp_model_state_dict_rank0
+from higgsfield.checkpoint.mmap_utils import load_model_from_checkpoint
 
 def load_mistral_from_config(model_name, num_embeddings=None):
     config = MistralConfig.from_pretrained(model_name)
@@ -14,8 +13,14 @@ def load_mistral_from_config(model_name, num_embeddings=None):
         
     return model
 
-def load_mistral_from_checkpoint(model_name, checkpoint_path, num_embeddings=None):
-    model = load_mistral_from_config(model_name, num_embeddings=num_embeddings)
-    state_dict = torch.load(checkpoint_path)
-    model.load_state_dict(state_dict)
-    return model
\ No newline at end of file
+def load_mistral_from_checkpoint(model_name, checkpoint_path, num_embeddings=None, dtype=None):
+    '''
+        checkpoint_path: model.safetensors or model.pt, memory mapped
+        dtype: parameters dtype, float32 by default
+    '''
+    config = MistralConfig.from_pretrained(model_name)
+    
+    if num_embeddings:
+        config.vocab_size = num_embeddings
+        
+    return load_model_from_checkpoint(MistralForCausalLM, config, checkpoint_path, dtype=dtype)
@@ -0,0 +1 @@
+from .causal_lm import FSDPCausalLM
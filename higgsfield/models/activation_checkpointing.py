@@ -0,0 +1,159 @@
+import re
+
+import torch
+from torch.distributed.algorithms._checkpoint.checkpoint_wrapper import (
+    CheckpointWrapper,
+    CheckpointImpl,
+    apply_activation_checkpointing,
+)
+
+
+def activation_bytes_per_token(config, dtype):
+    '''
+        Estimated bytes of activations a decoder layer keeps for backward
+        per token when it is not checkpointed: its input, the normalized
+        inputs, q, k, v, the attention output, the MLP's intermediate
+        activations and fp32 norm statistics. Memory efficient attention
+        (sdpa / flash) is assumed, eager attention also keeps the attention
+        probabilities.
+    '''
+    hidden_size       = config.hidden_size
+    intermediate_size = getattr(config, "intermediate_size", None) or 4 * hidden_size
+    num_heads         = config.num_attention_heads
+    num_kv_heads      = getattr(config, "num_key_value_heads", None) or num_heads
+    kv_size           = hidden_size // num_heads * num_kv_heads
+
+    element_size = torch.tensor([], dtype=dtype).element_size()
+
+    return element_size * (7 * hidden_size + 2 * kv_size + 4 * intermediate_size) + 8 * hidden_size
+
+class ActivationCheckpointing:
+    '''
+        Which decoder layers recompute their forward pass in backward
+        instead of keeping their activations.
+
+        policy:
+            none: no layer, fastest, most memory
+            all: every layer, only the layer inputs are kept
+            every_{n}: every n-th layer, e.g. every_2
+            budget: as few layers as fit the activations of a forward pass
+                into memory_budget GiB, decided for the number of tokens of
+                every batch
+    '''
+    POLICY = re.compile(r"^(none|all|budget|every_(\d+))$")
+
+    def __init__(
+        self,
+        policy,
+        num_layers,
+        bytes_per_token,
+        input_bytes_per_token,
+        memory_budget=None,
+    ):
+        match = self.POLICY.match(policy or "none")
+        if not match:
+            raise ValueError(f"activation_checkpointing can be none, all, every_{{n}} or budget, got {policy}")
+
+        if match[1] == "budget" and not memory_budget:
+            raise ValueError("activation_checkpointing=\"budget\" needs activation_memory_budget in GiB")
+
+        self.policy                = match[1] if match[2] is None else "every"
+        self.every                 = int(match[2]) if match[2] else None
+        self.num_layers            = num_layers
+        self.bytes_per_token       = bytes_per_token
+        self.input_bytes_per_token = input_bytes_per_token
+        self.memory_budget         = memory_budget
+        self.num_full_layers       = 0
+
+        if self.every is not None and self.every < 1:
+            raise ValueError("every_{n} needs n >= 1")
+
+    def set_tokens(self, tokens):
+        '''
+            budget: the number of layers that keep their activations for a
+            forward pass of tokens tokens, the last layers keep them.
+        '''
+        if self.policy != "budget":
+            return
+
+        budget    = self.memory_budget * 2**30
+        checked   = self.num_layers * tokens * self.input_bytes_per_token
+        per_layer = tokens * (self.bytes_per_token - self.input_bytes_per_token)
+
+        self.num_full_layers = min(max(int((budget - checked) // per_layer), 0), self.num_layers)
+
+    def checkpoint(self, index):
+        if self.policy == "none":
+            return False
+
+        if self.policy == "all":
+            return True
+
+        if self.policy == "every":
+            return index % self.every == 0
+
+        return index < self.num_layers - self.num_full_layers
+
+    def num_checkpointed(self):
+        return sum(self.checkpoint(i) for i in range(self.num_layers))
+
+    def activation_bytes(self, tokens):
+        '''
+            Estimated activations of the decoder layers for a forward pass
+            of tokens tokens.
+        '''
+        self.set_tokens(tokens)
+        checkpointed = self.num_checkpointed()
+
+        return tokens * (
+            checkpointed * self.input_bytes_per_token
+            + (self.num_layers - checkpointed) * self.bytes_per_token
+        )
+
+    def report(self, tokens):
+        activations = self.activation_bytes(tokens)
+
+        return (
+            f"Activation checkpointing {self.policy if self.every is None else f'every_{self.every}'}: "
+            f"{self.num_checkpointed()}/{self.num_layers} layers recomputed, "
+            f"~{activations / 2**30:.2f} GiB of activations per {tokens} tokens"
+        )
+
+class SelectiveCheckpointWrapper(CheckpointWrapper):
+    '''
+        Non-reentrant CheckpointWrapper of a decoder layer that asks the
+        ActivationCheckpointing policy on every forward whether to
+        checkpoint. Every layer is wrapped, whatever the policy, so state
+        dict keys are the same for all policies.
+    '''
+    def __init__(self, module, policy, index):
+        super().__init__(module, checkpoint_impl=CheckpointImpl.NO_REENTRANT)
+
+        self.policy      = policy
+        self.layer_index = index
+
+    def forward(self, *args, **kwargs):
+        if self.policy.checkpoint(self.layer_index):
+            return super().forward(*args, **kwargs)
+
+        return self._checkpoint_wrapped_module(*args, **kwargs)
+
+def apply_selective_checkpointing(model, decoder_layer_cls, policy):
+    '''
+        Wraps every decoder layer of model (decoder_layer_cls instances,
+        numbered in module order) in a SelectiveCheckpointWrapper of policy.
+    '''
+    decoder_layer_cls = tuple(decoder_layer_cls)
+
+    indices = {}
+    for module in model.modules():
+        if isinstance(module, decoder_layer_cls):
+            indices[id(module)] = len(indices)
+
+    apply_activation_checkpointing(
+        model,
+        checkpoint_wrapper_fn=lambda module: SelectiveCheckpointWrapper(module, policy, indices[id(module)]),
+        check_fn=lambda submodule: isinstance(submodule, decoder_layer_cls),
+    )
+
+    return len(indices)
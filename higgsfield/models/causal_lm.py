@@ -0,0 +1,378 @@
+import os
+import functools
+from pathlib import Path
+
+import torch
+import torch.distributed as dist
+
+from torch.distributed.fsdp.fully_sharded_data_parallel import (
+    FullyShardedDataParallel as FSDP,
+    CPUOffload,
+)
+
+from torch.distributed.fsdp import (
+    MixedPrecision,
+)
+from torch.distributed.fsdp.wrap import (
+    transformer_auto_wrap_policy,
+)
+
+from transformers import (
+    AutoConfig,
+    AutoModelForCausalLM,
+)
+from transformers.models.auto.modeling_auto import MODEL_FOR_CAUSAL_LM_MAPPING
+
+from higgsfield.checkpoint.fsdp_checkpoint import (
+    save_distributed_model_rank0,
+    fsdp_model_state_dict_rank0,
+)
+from higgsfield.checkpoint.mmap_utils import (
+    init_empty_weights,
+    load_model_from_checkpoint,
+)
+
+from .activation_checkpointing import (
+    ActivationCheckpointing,
+    activation_bytes_per_token,
+    apply_selective_checkpointing,
+)
+from .loss import enable_chunked_loss
+from .compilation import (
+    CompileReport,
+    enable_compile_cache,
+    compile_decoder_layers,
+)
+from .sharding import (
+    SHARDING_STRATEGIES,
+    resolve_sharding,
+    hybrid_process_groups,
+)
+
+
+def get_device():
+    if torch.cuda.is_available():
+        return torch.device("cuda", torch.cuda.current_device())
+    return torch.device("cpu")
+
+def decoder_layer_classes(model):
+    '''
+        Classes of the modules huggingface never splits across devices
+        (model._no_split_modules), the decoder layers of a causal LM.
+    '''
+    names = set(getattr(model, "_no_split_modules", None) or [])
+    return {type(module) for module in model.modules() if type(module).__name__ in names}
+
+class FSDPCausalLM(FSDP):
+    '''
+        FSDP wrapper of a huggingface causal LM, every decoder layer is an
+        FSDP unit and an activation checkpointing unit, see
+        activation_checkpointing. Model families set
+        model_cls, config_cls and decoder_layer_cls, by default they are
+        looked up from model_name.
+
+        Only rank 0 holds weights in host memory, every other rank builds
+        the model on the meta device. FSDP then moves rank 0's weights to
+        the GPU and broadcasts them one decoder layer at a time, so a node
+        needs about one copy of the model in host memory instead of one
+        per GPU.
+    '''
+    model_cls         = AutoModelForCausalLM
+    config_cls        = AutoConfig
+    decoder_layer_cls = None
+
+    def __init__(
+        self,
+        model_name,
+        checkpoint_path=None,
+        zero_stage=3,
+        fast_attn=False,
+        precision="bf16",
+        cpu_init_rank0=True,
+        cpu_offload=False,
+        num_embeddings=None,
+        cache_dir=None,
+        sharding=None,
+        shard_group_size=None,
+        activation_checkpointing="all",
+        activation_memory_budget=None,
+        compile=False,
+        chunked_loss=False,
+    ):
+        '''
+            model_name: huggingface model name or path
+            checkpoint_path: model.safetensors / model.pt /
+                model.safetensors.index.json to take the weights from
+                instead of model_name, memory mapped on rank 0
+            cpu_init_rank0: only rank 0 loads the weights, the other ranks
+                get them from rank 0. With False every rank loads its own
+                copy of the pretrained weights.
+            num_embeddings: resizes the token embeddings, e.g. after adding
+                tokens to the tokenizer
+            sharding: overrides zero_stage, one of
+                no_shard (zero_stage=0): replicated like DDP
+                zero1 (zero_stage=1): replicated parameters and gradients,
+                    optimizer states sharded, see build_optimizer
+                shard_grad_op (zero_stage=2): gradients and optimizer states
+                    sharded
+                full_shard (zero_stage=3): parameters, gradients and
+                    optimizer states sharded
+                hybrid_shard: full_shard inside groups of shard_group_size
+                    ranks, replicated across the groups
+                hybrid_shard_zero2: shard_grad_op inside the groups,
+                    replicated across the groups
+            shard_group_size: ranks per group of the hybrid shardings, by
+                default the ranks of one node
+            activation_checkpointing: which decoder layers recompute their
+                activations in backward instead of keeping them
+                all: every layer, least memory, ~1/3 more compute
+                none: no layer, fastest
+                every_{n}: every n-th layer, e.g. every_2 keeps half of them
+                budget: as few layers as keep the estimated activations of
+                    a forward pass under activation_memory_budget GiB,
+                    decided per batch from its number of tokens
+            activation_memory_budget: GiB of decoder layer activations per
+                GPU for activation_checkpointing="budget"
+            compile: compiles every decoder layer with torch.compile, True
+                or a torch.compile mode (e.g. "max-autotune-no-cudagraphs").
+                Compiled kernels are cached in {run path}/compile_cache, a
+                restarted run reuses them. Under Trainer rank 0 prints the
+                compile time after the first optimizer steps.
+            chunked_loss: computes the loss without the full logits,
+                projecting and scoring 1024 labeled positions at a time, or
+                this many if an int, see chunked_cross_entropy.
+        '''
+        rank = dist.get_rank()
+
+        config = self.config_cls.from_pretrained(model_name, cache_dir=cache_dir, use_cache=False)
+        if num_embeddings:
+            config.vocab_size = num_embeddings
+
+        model_cls = self.model_cls
+        if model_cls is AutoModelForCausalLM:
+            model_cls = MODEL_FOR_CAUSAL_LM_MAPPING[type(config)]
+
+        # pure bf16 weights are loaded as bf16 right away
+        dtype = torch.bfloat16 if precision == "bf16" else torch.float32
+
+        if checkpoint_path and not cpu_init_rank0:
+            print("Ignoring cpu_init_rank0=False while loading model from checkpoint path")
+            cpu_init_rank0 = True
+
+        if cpu_init_rank0 and rank != 0:
+            with torch.device("meta"):
+                model = model_cls(config)
+
+        elif checkpoint_path:
+            model = load_model_from_checkpoint(model_cls, config, checkpoint_path, dtype=dtype)
+            print("LOADED FROM CHECKPOINT")
+
+        else:
+            model = model_cls.from_pretrained(
+                model_name,
+                cache_dir=cache_dir,
+                use_cache=False,
+                torch_dtype=dtype,
+            )
+
+            if num_embeddings:
+                model.resize_token_embeddings(num_embeddings)
+
+        if fast_attn:
+            #raise NotImplementedError("Fast attention is not supported yet")
+            from optimum.bettertransformer import BetterTransformer
+            model = BetterTransformer.transform(model)
+
+        if chunked_loss:
+            enable_chunked_loss(model, 1024 if chunked_loss is True else chunked_loss)
+
+        fpSixteen = MixedPrecision(
+            param_dtype=torch.float16,
+            reduce_dtype=torch.float16,
+            buffer_dtype=torch.float16,
+        )
+
+        bfSixteen_mixed = MixedPrecision(
+            param_dtype=torch.float32,
+            reduce_dtype=torch.bfloat16,
+            buffer_dtype=torch.bfloat16,
+        )
+
+        pure_bf16 = False
+        if precision == "fp16":
+            mixed_precision_policy = fpSixteen
+
+        elif precision == "bf16":
+            mixed_precision_policy = None
+            pure_bf16 = True
+
+        elif precision == "bf16_mixed":
+            mixed_precision_policy = bfSixteen_mixed
+
+        else:
+            mixed_precision_policy = None
+
+        if pure_bf16:
+            model.to(torch.bfloat16)
+
+        decoder_layer_cls = self.decoder_layer_cls or decoder_layer_classes(model)
+        if isinstance(decoder_layer_cls, type):
+            decoder_layer_cls = {decoder_layer_cls}
+
+        if not decoder_layer_cls:
+            raise ValueError(f"Can't find the decoder layers of {model_name}, set decoder_layer_cls")
+
+        wrapping_policy = functools.partial(
+            transformer_auto_wrap_policy,
+            transformer_layer_cls=set(decoder_layer_cls),
+        )
+
+        sharding = resolve_sharding(zero_stage, sharding)
+        sharding_strategy = SHARDING_STRATEGIES[sharding]
+
+        if sharding.startswith("hybrid"):
+            process_group = hybrid_process_groups(shard_group_size)
+        else:
+            process_group = None
+
+        device = get_device()
+
+        if cpu_init_rank0 and rank != 0:
+            param_init_fn = lambda module: module.to_empty(
+                device=device,
+                recurse=False,
+            )
+        else:
+            param_init_fn = None
+
+        if cpu_offload:
+            cpu_offload = CPUOffload(offload_params=True)
+        else:
+            cpu_offload = None
+
+        super().__init__(
+            model,
+            process_group=process_group,
+            auto_wrap_policy=wrapping_policy,
+            cpu_offload=cpu_offload,
+            mixed_precision=mixed_precision_policy,
+            sharding_strategy=sharding_strategy,
+            device_id=device,
+            limit_all_gathers=True,
+            sync_module_states=cpu_init_rank0,
+            param_init_fn=param_init_fn,
+            # compiled layers see their original parameters instead of
+            # views into FSDP's flat parameter swapped in every forward
+            use_orig_params=bool(compile),
+        )
+
+        # fp16 runs under autocast, bf16_mixed computes in fp32
+        activation_dtype = {
+            "bf16": torch.bfloat16,
+            "fp16": torch.float16,
+        }.get(precision, torch.float32)
+
+        num_layers = sum(isinstance(module, tuple(decoder_layer_cls)) for module in model.modules())
+
+        checkpointing = ActivationCheckpointing(
+            activation_checkpointing,
+            num_layers=num_layers,
+            bytes_per_token=activation_bytes_per_token(config, activation_dtype),
+            input_bytes_per_token=config.hidden_size * torch.tensor([], dtype=activation_dtype).element_size(),
+            memory_budget=activation_memory_budget,
+        )
+
+        apply_selective_checkpointing(self, decoder_layer_cls, checkpointing)
+
+        if rank == 0:
+            print(checkpointing.report(getattr(config, "max_position_embeddings", 4096)))
+
+        compile_report = None
+        if compile:
+            cache_dir = enable_compile_cache()
+            compile_decoder_layers(self, decoder_layer_cls, mode=None if compile is True else compile)
+
+            if rank == 0:
+                compile_report = CompileReport(cache_dir=cache_dir)
+
+        fsdp = True
+        self.precision = precision
+        self.sharding = sharding
+        self.fsdp = fsdp
+        self.model_name = model_name
+        self.model_config = config
+        self.causal_lm_cls = model_cls
+        self.num_embeddings = num_embeddings
+        self.device = device
+        self.activation_checkpointing = checkpointing
+        self.compile_report = compile_report
+
+    def __call__(self, batch):
+        # batches of a DevicePrefetcher are on the device already
+        for key in batch.keys():
+            if batch[key].device != self.device:
+                batch[key] = batch[key].to(self.device, non_blocking=True)
+
+        self.activation_checkpointing.set_tokens(batch["input_ids"].numel())
+
+        if self.precision == "fp16":
+            with torch.cuda.amp.autocast():
+                loss = super().__call__(**batch).loss
+        else:
+            loss = super().__call__(**batch).loss
+
+        return loss
+
+    def save_model(self, save_path):
+        '''
+            Save model's weight to master node
+                ~/.cache/higgsfield/{save_path}
+        '''
+        if "/" == save_path[0]:
+            save_path = save_path[1:]
+
+        head, tail = os.path.split(save_path)
+
+        path = Path.home() / ".cache/higgsfield" / head
+        path.mkdir(exist_ok=True, parents=True)
+
+        save_distributed_model_rank0(path / tail, self)
+
+    def _pretrained_model(self):
+        '''
+            The full model as a huggingface model on rank 0, None on the
+            other ranks. Its parameters are the gathered state dict itself.
+        '''
+        cpu_state = fsdp_model_state_dict_rank0(self)
+
+        if dist.get_rank() != 0:
+            return None
+
+        with init_empty_weights():
+            model = self.causal_lm_cls(self.model_config)
+
+        model.load_state_dict(cpu_state, assign=True)
+        model.tie_weights()
+        return model
+
+    def save_huggingface_model(self, save_path):
+        '''
+            Save model's weight in huggingface format to master node
+                ~/.cache/higgsfield/{save_path}
+        '''
+        if "/" == save_path[0]:
+            save_path = save_path[1:]
+
+        head, tail = os.path.split(save_path)
+
+        path = Path.home() / ".cache/higgsfield" / head
+        path.mkdir(exist_ok=True, parents=True)
+
+        model = self._pretrained_model()
+        if model is not None:
+           model.save_pretrained(path / tail)
+
+    def push_to_hub(self, repo_id, token=None):
+        model = self._pretrained_model()
+        if model is not None:
+           model.push_to_hub(repo_id, token=token)
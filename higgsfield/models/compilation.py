@@ -0,0 +1,94 @@
+import os
+import time
+import statistics
+from pathlib import Path
+
+
+def compile_cache_dir():
+    '''
+        {run path}/compile_cache when running as a higgsfield experiment,
+        None otherwise.
+    '''
+    if not (os.environ.get("PROJECT_NAME") and os.environ.get("EXPERIMENT_NAME") and os.environ.get("RUN_NAME")):
+        return None
+
+    from higgsfield.checkpoint.fsdp_checkpoint import default_checkpoint_path
+    return default_checkpoint_path() / "compile_cache"
+
+def enable_compile_cache(path=None):
+    '''
+        Keeps inductor's compiled graphs and kernels (FX graph, autograd
+        and triton caches) in path, by default compile_cache_dir(), so a
+        restarted run loads them instead of compiling again. Keeps a
+        TORCHINDUCTOR_CACHE_DIR set by the user before higgsfield was
+        imported. Returns the cache directory, None if inductor's default
+        is used.
+    '''
+    from higgsfield import USER_INDUCTOR_CACHE_DIR
+
+    if USER_INDUCTOR_CACHE_DIR:
+        return Path(USER_INDUCTOR_CACHE_DIR)
+
+    path = path or compile_cache_dir()
+    if path is None:
+        return None
+
+    Path(path).mkdir(parents=True, exist_ok=True)
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(path)
+
+    return Path(path)
+
+def compile_decoder_layers(model, decoder_layer_cls, mode=None):
+    '''
+        Compiles every decoder layer of model in place (nn.Module.compile),
+        inside its FSDP unit and activation checkpointing wrapper, so the
+        state dict keys don't change. Every layer has the same code and
+        shapes, they share one compiled graph.
+    '''
+    decoder_layer_cls = tuple(decoder_layer_cls)
+
+    num_layers = 0
+    for module in model.modules():
+        if isinstance(module, decoder_layer_cls):
+            module.compile(mode=mode)
+            num_layers += 1
+
+    return num_layers
+
+class CompileReport:
+    '''
+        Times the steps between calls of step(), which Trainer makes once
+        per optimizer step for an FSDPCausalLM's compile_report. The first
+        steps compile (forward and backward of a new shape), after
+        warmup_steps + measure_steps steps it prints the time the first
+        step took more than the median of the measured steps, i.e. the
+        compile time.
+    '''
+    def __init__(self, warmup_steps=2, measure_steps=10, cache_dir=None):
+        self.warmup_steps  = warmup_steps
+        self.measure_steps = measure_steps
+        self.cache_dir     = cache_dir
+        self.times         = []
+        self.last          = None
+        self.reported      = False
+
+    def step(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.times.append(now - self.last)
+        self.last = now
+
+        if not self.reported and len(self.times) >= self.warmup_steps + self.measure_steps:
+            self.reported = True
+            print(self.report())
+
+    def report(self):
+        steady = statistics.median(self.times[self.warmup_steps:])
+        first  = self.times[0]
+
+        cache = f", cache {self.cache_dir}" if self.cache_dir else ""
+
+        return (
+            f"torch.compile: first step {first:.2f}s, steady step {steady:.3f}s, "
+            f"~{max(first - steady, 0):.1f}s compiling{cache}"
+        )
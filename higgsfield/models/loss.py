@@ -0,0 +1,77 @@
+import functools
+
+import torch
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+from transformers.modeling_outputs import CausalLMOutputWithPast
+
+
+IGNORE_INDEX = -100
+
+def _chunk_loss(hidden_states, weight, bias, labels):
+    logits = F.linear(hidden_states, weight, bias).float()
+    return F.cross_entropy(logits, labels, reduction="sum")
+
+def chunked_cross_entropy(hidden_states, lm_head, labels, chunk_size=1024):
+    '''
+        Causal LM loss of huggingface's .loss (mean cross entropy of the
+        next token over the labels that are not -100) without the full
+        [batch, seq_len, vocab_size] logits.
+
+        hidden_states: [batch, seq_len, hidden_size] output of the decoder
+        lm_head: nn.Linear projecting hidden states to the vocabulary
+
+        Only positions with a label are projected, chunk_size of them at a
+        time. The logits of every chunk are recomputed in backward instead
+        of being kept, so at most one chunk of fp32 logits exists at once.
+    '''
+    labels = F.pad(labels, (0, 1), value=IGNORE_INDEX)[:, 1:]
+    keep   = labels != IGNORE_INDEX
+
+    hidden_states = hidden_states[keep]
+    labels        = labels[keep]
+
+    loss = hidden_states.new_zeros((), dtype=torch.float32)
+    for start in range(0, labels.numel(), chunk_size):
+        loss = loss + checkpoint(
+            _chunk_loss,
+            hidden_states[start:start + chunk_size],
+            lm_head.weight,
+            lm_head.bias,
+            labels[start:start + chunk_size],
+            use_reentrant=False,
+        )
+
+    # 0 / 0 like cross_entropy when no position has a label
+    return loss / labels.numel()
+
+def enable_chunked_loss(model, chunk_size=1024):
+    '''
+        Makes model(..., labels=labels) of a huggingface causal LM compute
+        its loss with chunked_cross_entropy inside its own forward, so FSDP
+        still holds the gathered lm_head. Outputs have no logits then.
+        Without labels, e.g. in generate(), the model runs as before.
+    '''
+    forward = model.forward
+
+    @functools.wraps(forward)
+    def chunked_forward(*args, labels=None, **kwargs):
+        if labels is None:
+            return forward(*args, **kwargs)
+
+        outputs = model.get_decoder()(*args, **kwargs)
+        loss = chunked_cross_entropy(
+            outputs.last_hidden_state,
+            model.get_output_embeddings(),
+            labels,
+            chunk_size,
+        )
+
+        return CausalLMOutputWithPast(
+            loss=loss,
+            past_key_values=outputs.past_key_values,
+        )
+
+    model.forward = chunked_forward
+    return model
@@ -0,0 +1,72 @@
+import os
+
+import torch.distributed as dist
+from torch.distributed.fsdp import ShardingStrategy
+
+
+SHARDING_STRATEGIES = {
+    "no_shard": ShardingStrategy.NO_SHARD,
+    # parameters and gradients are replicated like no_shard, only the
+    # optimizer states are sharded, see build_optimizer
+    "zero1": ShardingStrategy.NO_SHARD,
+    "shard_grad_op": ShardingStrategy.SHARD_GRAD_OP,
+    "full_shard": ShardingStrategy.FULL_SHARD,
+    "hybrid_shard": ShardingStrategy.HYBRID_SHARD,
+    "hybrid_shard_zero2": ShardingStrategy._HYBRID_SHARD_ZERO2,
+}
+
+ZERO_STAGES = {
+    0: "no_shard",
+    1: "zero1",
+    2: "shard_grad_op",
+    3: "full_shard",
+}
+
+def resolve_sharding(zero_stage=3, sharding=None):
+    '''
+        Name of the sharding to use, sharding if given, else the one of
+        zero_stage.
+    '''
+    if sharding is None:
+        if zero_stage not in ZERO_STAGES:
+            raise NotImplementedError("stage can be only 0 1 2 3")
+        sharding = ZERO_STAGES[zero_stage]
+
+    if sharding not in SHARDING_STRATEGIES:
+        raise ValueError(f"sharding can be one of {', '.join(SHARDING_STRATEGIES)}, got {sharding}")
+
+    return sharding
+
+def hybrid_process_groups(shard_group_size=None):
+    '''
+        (shard group, replicate group) of this rank for hybrid sharding:
+        parameters are sharded inside groups of shard_group_size
+        consecutive ranks and replicated across the groups. By default a
+        group is one node (LOCAL_WORLD_SIZE ranks), so the all-gathers and
+        reduce-scatters of every layer stay on the intra-node links and
+        only the gradient all-reduce crosses nodes.
+
+        Every rank has to call it, it creates all the groups.
+    '''
+    world_size = dist.get_world_size()
+    rank       = dist.get_rank()
+
+    if shard_group_size is None:
+        shard_group_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+
+    if shard_group_size < 1 or world_size % shard_group_size != 0:
+        raise ValueError(f"shard_group_size {shard_group_size} has to divide the world size {world_size}")
+
+    shard_group, replicate_group = None, None
+
+    for start in range(0, world_size, shard_group_size):
+        group = dist.new_group(list(range(start, start + shard_group_size)))
+        if start <= rank < start + shard_group_size:
+            shard_group = group
+
+    for offset in range(shard_group_size):
+        group = dist.new_group(list(range(offset, world_size, shard_group_size)))
+        if rank % shard_group_size == offset:
+            replicate_group = group
+
+    return shard_group, replicate_group
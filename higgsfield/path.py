@@ -112,6 +112,19 @@ class RunPath:
                 print(e)
         return path
 
+    def profile_path(self) -> pathlib.Path:
+        path = self.experiment_path.path / f"profiles/{self.run_name}"
+
+        try:
+            path.mkdir(exist_ok=True, parents=True)
+        except Exception as e:
+            if self.experiment_path.project_path.verbose:
+                print("this error shouldn't have been thrown")
+                print(f"error creating path {path}")
+                print(e)
+
+        return path
+
     def lr_scheduler_path(self) -> pathlib.Path:
         path = self.experiment_path.path / f"lr-schedulers/{self.run_name}"
 
@@ -0,0 +1,153 @@
+import contextlib
+from pathlib import Path
+
+import torch
+
+
+# profile="wait=10,warmup=2,active=3" of higgsfield run, profile=1 for
+# these defaults
+PROFILE_DEFAULTS = {
+    "wait": 10,
+    "warmup": 2,
+    "active": 3,
+    "repeat": 1,
+    "top": 30,
+    "memory": 0,
+    "stack": 0,
+    "ranks": "all",
+}
+
+_active = None
+
+def parse_profile(spec):
+    '''
+        Options of the reserved profile param of every experiment, None
+        when profiling is off (none, the default). Comma separated
+        key=value pairs of PROFILE_DEFAULTS, 1 / true for the defaults.
+        ranks is all or the ranks to profile separated by ":", e.g. 0:8.
+    '''
+    spec = (spec or "").strip().lower()
+    if spec in ("", "none", "0", "false", "no", "off"):
+        return None
+
+    options = dict(PROFILE_DEFAULTS)
+    if spec in ("1", "true", "yes", "on"):
+        return options
+
+    for item in spec.split(","):
+        key, _, value = item.partition("=")
+        key, value = key.strip(), value.strip()
+
+        if key not in PROFILE_DEFAULTS or not value:
+            raise ValueError(f"profile takes {', '.join(k + '=' for k in PROFILE_DEFAULTS)}, got {item}")
+
+        options[key] = value if key == "ranks" else int(value)
+
+    return options
+
+class Profiler:
+    '''
+        torch.profiler over a window of steps: wait steps are skipped,
+        warmup steps are profiled and thrown away, active steps are
+        recorded, repeat times. Every recorded window writes to trace_dir:
+            rank_{rank}.step_{step}.pt.trace.json: chrome trace, opens in
+                chrome://tracing, perfetto or TensorBoard's profiler plugin
+            rank_{rank}.step_{step}.top_ops.txt: the top operators by self
+                time (self CUDA time on GPU), rank 0 also prints it
+    '''
+    def __init__(
+        self,
+        trace_dir,
+        rank=0,
+        wait=10,
+        warmup=2,
+        active=3,
+        repeat=1,
+        top=30,
+        memory=0,
+        stack=0,
+    ):
+        self.trace_dir = Path(trace_dir)
+        self.rank      = rank
+        self.top       = top
+        self.cuda      = torch.cuda.is_available()
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        self.profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(
+                wait=wait,
+                warmup=warmup,
+                active=active,
+                repeat=repeat,
+            ),
+            on_trace_ready=self._trace_ready,
+            record_shapes=True,
+            profile_memory=bool(memory),
+            with_stack=bool(stack),
+        )
+
+    def _trace_ready(self, profiler):
+        self.trace_dir.mkdir(parents=True, exist_ok=True)
+        name = f"rank_{self.rank}.step_{profiler.step_num}"
+
+        profiler.export_chrome_trace(str(self.trace_dir / f"{name}.pt.trace.json"))
+
+        sort_by = "self_cuda_time_total" if self.cuda else "self_cpu_time_total"
+        table = profiler.key_averages().table(sort_by=sort_by, row_limit=self.top)
+
+        with open(self.trace_dir / f"{name}.top_ops.txt", "w") as f:
+            f.write(table)
+
+        if self.rank == 0:
+            print(f"Profile of rank 0 up to step {profiler.step_num}, traces in {self.trace_dir}")
+            print(table)
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    def step(self):
+        self.profiler.step()
+
+def step():
+    '''
+        Advances the profiler of the run, if any. Trainer calls it after
+        every optimizer step, custom training loops call it once per
+        optimizer step, after all of its micro-batches.
+    '''
+    if _active is not None:
+        _active.step()
+
+@contextlib.contextmanager
+def profile(spec, trace_dir, rank=0):
+    '''
+        Profiles the code inside with the options of parse_profile(spec),
+        on this rank only if it is one of the profiled ranks.
+    '''
+    global _active
+
+    options = parse_profile(spec)
+    if options is None:
+        yield None
+        return
+
+    ranks = options.pop("ranks")
+    if ranks != "all" and rank not in {int(r) for r in ranks.split(":")}:
+        yield None
+        return
+
+    profiler = Profiler(trace_dir, rank=rank, **options)
+    profiler.start()
+    _active = profiler
+
+    try:
+        yield profiler
+    finally:
+        _active = None
+        profiler.stop()
@@ -2,9 +2,9 @@ import torch.optim as optim
 from torch.optim.lr_scheduler import StepLR
 
 from higgsfield.llama import Llama
-from higgsfield.loaders import LlamaLoader 
+from higgsfield.loaders import LlamaLoader, DevicePrefetcher
 from higgsfield.checkpoint import Checkpoint
-from higgsfield.training import  clip_grad_norm
+from higgsfield.training import  build_optimizer, Trainer
 from higgsfield.experiment import experiment, param
 
 from src.dataset import AlpacaDataset
@@ -12,6 +12,9 @@ from src.dataset import AlpacaDataset
 @experiment("alpaca_bf16")
 @param("size", options=["7b", "13b", "70b"])
 @param("num_epochs", default=1, description="Number of epochs")
+@param("grad_accumulation_steps", default=1, description="Micro-batches per optimizer step")
+@param("sharding", options=["full_shard", "hybrid_shard", "hybrid_shard_zero2", "shard_grad_op", "zero1"], description="How the model is sharded across GPUs")
+@param("activation_checkpointing", options=["all", "every_2", "none"], description="Decoder layers recomputing their activations in backward")
 def train(params):
     
     if params.size == "7b":
@@ -23,15 +26,17 @@ def train(params):
     
     model = Llama(
         model_name=model_name,
-        zero_stage=3,
+        sharding=params.sharding,
+        activation_checkpointing=params.activation_checkpointing,
         cpu_init_rank0=True,
         fast_attn=False,
         precision="bf16",
         cpu_offload=False,
     )
     
-    optimizer = optim.AdamW(
-        model.parameters(),
+    optimizer = build_optimizer(
+        model,
+        optim.AdamW,
         lr=1e-5,
         weight_decay=0.0,
     )
@@ -42,40 +47,38 @@ def train(params):
         gamma=0.85,
     )
     
-    # ~/.cache/{project-name}/experiments/{experiment_name}/{run_name}/
-    checkpoint = Checkpoint(
-        model,
-        optimizer,
-        lr_scheduler,
-    )
-    
     dataset_name = "tatsu-lab/alpaca"
     dataset = AlpacaDataset(dataset_name, split="train")
     
-    train_loader = LlamaLoader(
+    # copies the next batches to the GPU while the current one trains
+    train_loader = DevicePrefetcher(LlamaLoader(
         dataset,
         max_sequence_length=2048,
         batch_size_per_gpu=1,
+        pin_memory=True,
+    ))
+    
+    # ~/.cache/{project-name}/experiments/{experiment_name}/{run_name}/
+    checkpoint = Checkpoint(
+        model,
+        optimizer,
+        lr_scheduler,
+        loader=train_loader,
     )
     
-    for epoch in range(params.num_epochs):
-        for i, batch in enumerate(train_loader):
-            
-            optimizer.zero_grad()
-            loss = model(batch)
-            
-            if params.rank == 0:
-                print("Loss: ", loss)
-                
-            loss.backward()
-            
-            clip_grad_norm(1.0, model, optimizer)
-            optimizer.step()
-
-            if i % 30 == 0 or i == len(train_loader) - 1:
-                checkpoint.save(epoch, i)
-            
-        lr_scheduler.step()
+    # a restarted run continues from its latest checkpoint, rank 0 logs
+    # loss, throughput, MFU and the time of every phase every 10 steps
+    trainer = Trainer(
+        model,
+        optimizer,
+        train_loader,
+        lr_scheduler,
+        checkpoint=checkpoint,
+        grad_accumulation_steps=params.grad_accumulation_steps,
+        max_grad_norm=1.0,
+        checkpoint_every=30,
+    )
+    trainer.fit(params.num_epochs)
         
     model.save_huggingface_model("my-alpaca")
     
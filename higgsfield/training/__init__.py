@@ -1,2 +1,5 @@
 from .grads import clip_grad_norm
-from .scaler import Scaler
\ No newline at end of file
+from .scaler import Scaler
+from .optimizer import build_optimizer
+from .accumulation import GradientAccumulator
+from .trainer import Trainer
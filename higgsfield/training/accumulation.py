@@ -0,0 +1,145 @@
+import math
+import contextlib
+
+import torch
+import torch.distributed as dist
+
+from higgsfield.dataset.dataset import IGNORE_INDEX
+
+
+def num_label_tokens(batch):
+    '''
+        Number of tokens the loss of batch averages over, as a tensor on
+        the batch's device: the labels that are not IGNORE_INDEX, without
+        the first position of every row which the causal LM shift drops.
+    '''
+    if "labels" in batch:
+        return (batch["labels"][..., 1:] != IGNORE_INDEX).sum()
+
+    if "attention_mask" in batch:
+        return batch["attention_mask"][..., 1:].sum()
+
+    input_ids = batch["input_ids"][..., 1:]
+    return torch.tensor(input_ids.numel(), device=input_ids.device)
+
+class GradientAccumulator:
+    '''
+        Runs steps micro-batches forward and backward per optimizer step.
+        Gradients are only communicated on the last micro-batch, the
+        others run under model.no_sync(), so an FSDP model reduce-scatters
+        (all-reduces without sharding) steps times less often.
+
+        The loss of every micro-batch is weighted by its number of label
+        tokens, summed over all the micro-batches of all ranks. The
+        gradient is the one of the mean loss over every token of the step,
+        as if all micro-batches were one batch, however differently they
+        are padded or masked.
+
+        no_sync: with sharded gradients (every sharding except no_shard
+            and zero1) the accumulated gradients are kept unsharded until
+            the last micro-batch, one full copy of the gradients per GPU.
+            no_sync=False reduce-scatters every micro-batch instead, same
+            gradients, no communication saved.
+
+        accumulator = GradientAccumulator(model, steps=8, scaler=scaler)
+
+        for batches in accumulator.split(train_loader):
+            optimizer.zero_grad()
+            loss = accumulator.backward(batches)
+            clip_grad_norm(1.0, model, optimizer, scaler)
+            scaler.step(optimizer)
+            scaler.update()
+    '''
+    def __init__(self, model, steps=1, scaler=None, no_sync=True):
+        if steps < 1:
+            raise ValueError(f"steps has to be at least 1, got {steps}")
+
+        self.model   = model
+        self.steps   = steps
+        self.scaler  = scaler
+        self.no_sync = no_sync
+
+    def split(self, loader):
+        '''
+            Groups the micro-batches of loader steps at a time, the last
+            group of an epoch can be shorter.
+        '''
+        group = []
+        for batch in loader:
+            group.append(batch)
+
+            if len(group) == self.steps:
+                yield group
+                group = []
+
+        if group:
+            yield group
+
+    def num_steps(self, loader):
+        '''
+            Optimizer steps split(loader) yields.
+        '''
+        return math.ceil(len(loader) / self.steps)
+
+    def sync_context(self, last):
+        '''
+            no_sync() of the model for every micro-batch but the last.
+        '''
+        if last or not self.no_sync or not hasattr(self.model, "no_sync"):
+            return contextlib.nullcontext()
+
+        return self.model.no_sync()
+
+    def loss_weights(self, batches):
+        '''
+            (weights, tokens) of the micro-batches: the mean loss of
+            batches[i] times weights[i] is its share of the gradient, its
+            label tokens over all label tokens of the step on every rank,
+            times the world size as FSDP averages the gradients over the
+            ranks. Stays on the device, without waiting for it.
+        '''
+        device = getattr(self.model, "device", None)
+        tokens = [num_label_tokens(batch).to(device) for batch in batches]
+
+        total = torch.stack(tokens).sum()
+        world_size = 1
+        if dist.is_initialized():
+            dist.all_reduce(total)
+            world_size = dist.get_world_size()
+
+        total = total.clamp(min=1)
+
+        return [num_tokens * world_size / total for num_tokens in tokens], tokens
+
+    def backward_loss(self, loss):
+        if self.scaler:
+            self.scaler.scale(loss).backward()
+        else:
+            loss.backward()
+
+    def backward(self, batches, phase=None):
+        '''
+            Forward and backward of every micro-batch of batches. Returns
+            the mean loss per label token of this rank's micro-batches,
+            detached, as a tensor so that logging it is the only sync.
+
+            phase: phase(name) is entered around the forward ("forward")
+                and the backward ("backward") of every micro-batch, e.g. to
+                time them, see Trainer.
+        '''
+        if phase is None:
+            phase = lambda name: contextlib.nullcontext()
+
+        weights, tokens = self.loss_weights(batches)
+
+        loss_sum = 0.0
+        for i, (batch, weight, num_tokens) in enumerate(zip(batches, weights, tokens)):
+            with self.sync_context(last=i == len(batches) - 1):
+                with phase("forward"):
+                    loss = self.model(batch)
+                loss_sum += loss.detach().float() * num_tokens
+
+                with phase("backward"):
+                    self.backward_loss(loss * weight)
+
+        return loss_sum / torch.stack(tokens).sum().clamp(min=1)
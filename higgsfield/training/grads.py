@@ -7,5 +7,5 @@ def clip_grad_norm(max_grad_norm, model, optimizer, scaler=None):
     if hasattr(optimizer, 'clip_grad_norm'):
         optimizer.clip_grad_norm(max_grad_norm)
         
-    elif hasattr(model.model, 'clip_grad_norm_'):
+    elif hasattr(model, 'clip_grad_norm_'):
         model.clip_grad_norm_(max_grad_norm)      
\ No newline at end of file
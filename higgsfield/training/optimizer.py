@@ -0,0 +1,18 @@
+from torch.distributed.optim import ZeroRedundancyOptimizer
+
+
+def build_optimizer(model, optimizer_cls, **kwargs):
+    '''
+        optimizer_cls(model.parameters(), **kwargs). With sharding="zero1"
+        every rank keeps only its partition of the optimizer states and
+        updates the matching parameters, which are then broadcast to the
+        other ranks (ZeroRedundancyOptimizer).
+    '''
+    if getattr(model, "sharding", None) == "zero1":
+        return ZeroRedundancyOptimizer(
+            model.parameters(),
+            optimizer_class=optimizer_cls,
+            **kwargs,
+        )
+
+    return optimizer_cls(model.parameters(), **kwargs)
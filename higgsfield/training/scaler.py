@@ -2,9 +2,19 @@ import torch
 from torch.distributed.fsdp.sharded_grad_scaler import ShardedGradScaler
 
 class Scaler(object):
+    '''
+        fp16 loss scaler, ShardedGradScaler for FSDP models, GradScaler
+        otherwise. scale, unscale_, step, update, state_dict and the other
+        methods of the scaler are available on it.
+    '''
     def __init__(self, model):
-        if model.fsdp:
+        if getattr(model, "fsdp", False):
             self.scaler = ShardedGradScaler()
         else:
-            return torch.cuda.amp.GradScaler()
- 
\ No newline at end of file
+            self.scaler = torch.amp.GradScaler()
+
+    def __getattr__(self, name):
+        if name == "scaler":
+            raise AttributeError(name)
+
+        return getattr(self.scaler, name)
@@ -0,0 +1,411 @@
+import time
+import queue
+import threading
+import functools
+import contextlib
+from collections import defaultdict
+
+import torch
+import torch.distributed as dist
+
+from higgsfield import profiling
+
+from .accumulation import GradientAccumulator
+from .grads import clip_grad_norm
+
+
+# dense bf16 / fp16 tensor core peak per GPU
+PEAK_TFLOPS = {
+    "H100 SXM": 989.0,
+    "H100 NVL": 835.0,
+    "H100 PCIe": 756.0,
+    "H100": 989.0,
+    "H800": 989.0,
+    "A100": 312.0,
+    "A800": 312.0,
+    "L40S": 362.0,
+    "L4": 121.0,
+    "A10G": 125.0,
+    "A10": 125.0,
+    "V100": 125.0,
+}
+
+PHASES = ["data", "forward", "backward", "optimizer", "checkpoint"]
+
+def device_peak_tflops(device):
+    '''
+        Peak bf16 TFLOPS of a GPU from its name, None if unknown or CPU.
+    '''
+    if device.type != "cuda":
+        return None
+
+    name = torch.cuda.get_device_name(device)
+    for key, tflops in PEAK_TFLOPS.items():
+        if key in name:
+            return tflops
+
+    return None
+
+def model_flops_per_token(config, seq_len):
+    '''
+        Training FLOPs (forward + backward) per token of a decoder only
+        transformer, 6 * parameters of the matmuls plus the attention
+        scores, without the recomputation of activation checkpointing
+        (the model FLOPs of the PaLM paper's MFU).
+    '''
+    hidden_size       = config.hidden_size
+    num_layers        = config.num_hidden_layers
+    intermediate_size = getattr(config, "intermediate_size", None) or 4 * hidden_size
+    num_heads         = config.num_attention_heads
+    num_kv_heads      = getattr(config, "num_key_value_heads", None) or num_heads
+    kv_size           = hidden_size // num_heads * num_kv_heads
+
+    layer_params = 2 * hidden_size * hidden_size + 2 * hidden_size * kv_size + 3 * hidden_size * intermediate_size
+    matmul_params = num_layers * layer_params + config.vocab_size * hidden_size
+
+    return 6 * matmul_params + 12 * num_layers * hidden_size * seq_len
+
+class _Clock:
+    '''
+        Marks points of a step: CUDA events on the GPU, so the step is
+        timed on the device without waiting for it, wall time on CPU.
+    '''
+    def __init__(self, device):
+        self.cuda = device.type == "cuda"
+
+    def mark(self):
+        if self.cuda:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+
+        return time.perf_counter()
+
+    def elapsed(self, start, end):
+        if self.cuda:
+            return start.elapsed_time(end) / 1000
+
+        return end - start
+
+class MetricsLogger(threading.Thread):
+    '''
+        Turns step records into metrics in a background thread: it waits
+        for the last event of every step itself, so the training loop never
+        waits for the GPU to log. Every log_every steps it calls log_fn with
+        the means of the steps since the last call.
+    '''
+    def __init__(self, clock, log_fn, log_every, flops_per_token=None, peak_tflops=None):
+        super().__init__(daemon=True)
+
+        self.clock           = clock
+        self.log_fn          = log_fn
+        self.log_every       = log_every
+        self.flops_per_token = flops_per_token
+        self.peak_tflops     = peak_tflops
+        self.world_size      = dist.get_world_size() if dist.is_initialized() else 1
+        self.records         = queue.Queue()
+        self.metrics         = {}
+        self._window         = []
+
+    def put(self, record):
+        self.records.put(record)
+
+    def close(self):
+        self.records.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+
+            self._window.append(self._resolve(record))
+            if len(self._window) >= self.log_every:
+                self._log()
+
+        if self._window:
+            self._log()
+
+    def _resolve(self, record):
+        if self.clock.cuda:
+            record["end"].synchronize()
+
+        times = defaultdict(float)
+        times["data"] = record["data"]
+        times["checkpoint"] = record["checkpoint"]
+        for phase, start, end in record["spans"]:
+            times[phase] += self.clock.elapsed(start, end)
+
+        return {
+            "step": record["step"],
+            "loss": float(record["loss"]),
+            "tokens": record["tokens"],
+            "samples": record["samples"],
+            "seq_len": record["seq_len"],
+            "wall": record["wall"],
+            "times": times,
+            "memory": record["memory"],
+        }
+
+    def _log(self):
+        window, self._window = self._window, []
+
+        wall    = sum(step["wall"] for step in window)
+        tokens  = sum(step["tokens"] for step in window)
+        samples = sum(step["samples"] for step in window)
+
+        metrics = {
+            "train/step": window[-1]["step"],
+            "train/loss": sum(step["loss"] for step in window) / len(window),
+            "train/tokens_per_s": tokens * self.world_size / wall,
+            "train/tokens_per_s_per_gpu": tokens / wall,
+            "train/samples_per_s": samples * self.world_size / wall,
+            "train/step_time": wall / len(window),
+        }
+
+        for phase in PHASES:
+            metrics[f"time/{phase}"] = sum(step["times"][phase] for step in window) / len(window)
+
+        # highest memory of any step of the window
+        for step in window:
+            for key, value in step["memory"].items():
+                metrics[key] = max(metrics.get(key, 0), value)
+
+        if self.flops_per_token and self.peak_tflops:
+            seq_len = max(step["seq_len"] for step in window)
+            tflops  = self.flops_per_token(seq_len) * tokens / wall / 1e12
+            metrics["train/tflops_per_gpu"] = tflops
+            metrics["train/mfu"] = tflops / self.peak_tflops
+
+        self.metrics = metrics
+        self.log_fn(metrics)
+
+def print_metrics(metrics):
+    line = ", ".join(
+        f"{key.split('/')[-1]} {value:.4g}" if isinstance(value, float) else f"{key.split('/')[-1]} {value}"
+        for key, value in metrics.items()
+    )
+    print(line, flush=True)
+
+class Trainer:
+    '''
+        Training loop of a model, optimizer and loader: forward, backward
+        (grad_accumulation_steps micro-batches, see GradientAccumulator),
+        gradient clipping, optimizer step, zero_grad, a checkpoint every
+        checkpoint_every steps and at the end of every epoch, and the lr
+        schedule (every epoch, or every step with lr_scheduler_interval
+        "step"). fit() resumes from the latest checkpoint first, the step
+        count included.
+
+        Rank 0 logs every log_every steps through log_fn (print, or e.g.
+        wandb.log): loss, tokens/s (padded tokens, what the GPUs compute)
+        and samples/s of all GPUs (from rank 0's throughput), model FLOPs
+        utilization and the mean time per step of every phase (data wait,
+        forward, backward, optimizer, checkpoint). Phases are timed with CUDA events and logged from a
+        background thread, training never waits for the GPU to log.
+
+        MFU needs the peak TFLOPS of the GPU, looked up from its name in
+        PEAK_TFLOPS (dense bf16), or given as peak_tflops.
+
+        With a MemoryTracker as memory_tracker the phases also log their
+        allocated / reserved GPU memory and host RSS, current and peak, and
+        an out of memory error dumps the allocator state.
+
+        trainer = Trainer(model, optimizer, train_loader, lr_scheduler, checkpoint=checkpoint)
+        trainer.fit(num_epochs=3)
+    '''
+    def __init__(
+        self,
+        model,
+        optimizer,
+        loader,
+        lr_scheduler=None,
+        scaler=None,
+        checkpoint=None,
+        grad_accumulation_steps=1,
+        max_grad_norm=1.0,
+        checkpoint_every=30,
+        lr_scheduler_interval="epoch",
+        log_every=10,
+        log_fn=print_metrics,
+        peak_tflops=None,
+        memory_tracker=None,
+    ):
+        if lr_scheduler_interval not in ("epoch", "step"):
+            raise ValueError(f"lr_scheduler_interval can be epoch or step, got {lr_scheduler_interval}")
+
+        self.model                 = model
+        self.optimizer             = optimizer
+        self.loader                = loader
+        self.lr_scheduler          = lr_scheduler
+        self.scaler                = scaler
+        self.checkpoint            = checkpoint
+        self.max_grad_norm         = max_grad_norm
+        self.checkpoint_every      = checkpoint_every
+        self.lr_scheduler_interval = lr_scheduler_interval
+        self.log_every             = log_every
+        self.log_fn                = log_fn
+        self.rank                  = dist.get_rank() if dist.is_initialized() else 0
+        self.device                = getattr(model, "device", torch.device("cpu"))
+        self.clock                 = _Clock(self.device)
+        self.memory_tracker        = memory_tracker
+        self.step                  = 0
+
+        self.accumulator = GradientAccumulator(
+            model,
+            steps=grad_accumulation_steps,
+            scaler=scaler,
+        )
+
+        config = getattr(model, "model_config", None)
+        if config is not None:
+            self.flops_per_token = lambda seq_len: model_flops_per_token(config, seq_len)
+        else:
+            self.flops_per_token = None
+
+        self.peak_tflops = peak_tflops or device_peak_tflops(self.device)
+        self.logger = None
+
+    @property
+    def metrics(self):
+        '''
+            The metrics rank 0 logged last.
+        '''
+        return self.logger.metrics if self.logger else {}
+
+    def fit(self, num_epochs):
+        metadata = self.checkpoint.resume() if self.checkpoint else None
+        start_epoch = metadata["epoch"] if metadata else 0
+        self.step   = metadata.get("trainer_step", 0) if metadata else 0
+
+        if self.rank == 0:
+            self.logger = MetricsLogger(
+                self.clock,
+                self.log_fn,
+                self.log_every,
+                flops_per_token=self.flops_per_token,
+                peak_tflops=self.peak_tflops,
+            )
+            self.logger.start()
+
+        try:
+            for epoch in range(start_epoch, num_epochs):
+                self.train_epoch(epoch)
+
+                if self.lr_scheduler and self.lr_scheduler_interval == "epoch":
+                    self.lr_scheduler.step()
+
+            # the last save may still be written in the background, its
+            # error must not get lost
+            if self.checkpoint:
+                self.checkpoint.wait()
+        finally:
+            if self.logger:
+                self.logger.close()
+
+    def train_epoch(self, epoch):
+        self.loader.set_epoch(epoch)
+
+        batches_iter = self.accumulator.split(self.loader)
+        # an epoch resumed at its end has nothing new to save
+        saved = True
+
+        while True:
+            t0 = time.perf_counter()
+            batches = next(batches_iter, None)
+            data_time = time.perf_counter() - t0
+
+            if batches is None:
+                break
+
+            saved = self.train_step(epoch, batches, data_time, t0)
+
+        if self.checkpoint and not saved:
+            self._save(epoch)
+
+    def _save(self, epoch):
+        self.checkpoint.save(epoch, self.loader.batches, metadata={"trainer_step": self.step})
+
+    def _memory_phase(self, name):
+        if self.memory_tracker is None:
+            return contextlib.nullcontext()
+
+        return self.memory_tracker.phase(name)
+
+    @contextlib.contextmanager
+    def _phase(self, name, spans):
+        '''
+            Adds the (name, start, end) marks of the phase to spans and
+            tracks its memory.
+        '''
+        start = self.clock.mark()
+        with self._memory_phase(name):
+            yield
+        spans.append((name, start, self.clock.mark()))
+
+    def train_step(self, epoch, batches, data_time, t0):
+        '''
+            One optimizer step over the micro-batches batches, returns
+            whether it checkpointed.
+        '''
+        spans = []
+        phase = functools.partial(self._phase, spans=spans)
+
+        if self.memory_tracker:
+            self.memory_tracker.reset()
+
+        loss = self.accumulator.backward(batches, phase=phase)
+        if self.clock.cuda:
+            # copied to host memory behind the step, read once it is done
+            loss = loss.to("cpu", non_blocking=True)
+
+        with phase("optimizer"):
+            if self.max_grad_norm:
+                clip_grad_norm(self.max_grad_norm, self.model, self.optimizer, self.scaler)
+
+            if self.scaler:
+                self.scaler.step(self.optimizer)
+                self.scaler.update()
+            else:
+                self.optimizer.step()
+
+            self.optimizer.zero_grad(set_to_none=True)
+
+        if self.lr_scheduler and self.lr_scheduler_interval == "step":
+            self.lr_scheduler.step()
+
+        _, _, end = spans[-1]
+
+        self.step += 1
+        profiling.step()
+
+        compile_report = getattr(self.model, "compile_report", None)
+        if compile_report:
+            compile_report.step()
+
+        checkpoint_time = 0.0
+        saved = False
+        if self.checkpoint and self.checkpoint_every and self.step % self.checkpoint_every == 0:
+            start = time.perf_counter()
+            with self._memory_phase("checkpoint"):
+                self._save(epoch)
+            checkpoint_time = time.perf_counter() - start
+            saved = True
+
+        if self.logger:
+            self.logger.put({
+                "step": self.step,
+                "loss": loss,
+                "tokens": sum(batch["input_ids"].numel() for batch in batches),
+                "samples": sum(batch["input_ids"].shape[0] for batch in batches),
+                "seq_len": max(batch["input_ids"].shape[-1] for batch in batches),
+                "data": data_time,
+                "checkpoint": checkpoint_time,
+                "wall": time.perf_counter() - t0,
+                "spans": spans,
+                "end": end,
+                "memory": self.memory_tracker.metrics() if self.memory_tracker else {},
+            })
+
+        return saved
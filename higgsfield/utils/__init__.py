@@ -1 +1,7 @@
-from .utils import empty_cache
\ No newline at end of file
+from .memory import (
+    MemoryTracker,
+    TensorRegistry,
+    tensors,
+    host_memory,
+    empty_cache,
+)
@@ -0,0 +1,265 @@
+import os
+import gc
+import json
+import weakref
+import contextlib
+from pathlib import Path
+
+import torch
+
+
+GiB = 2**30
+
+def host_memory():
+    '''
+        (current, peak) resident memory of this process in bytes, peak
+        since the start or the last reset_host_peak().
+    '''
+    rss, peak = 0, 0
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith("VmHWM:"):
+                peak = int(line.split()[1]) * 1024
+
+    return rss, max(rss, peak)
+
+def reset_host_peak():
+    '''
+        Resets the peak resident memory (VmHWM) to the current one, returns
+        False where the kernel doesn't allow it.
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def is_out_of_memory(error):
+    if isinstance(error, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+
+    return isinstance(error, RuntimeError) and (
+        "out of memory" in str(error) or "can't allocate memory" in str(error)
+    )
+
+class TensorRegistry:
+    '''
+        Tensors registered by name, held by weak references, so listing or
+        freeing them needs no scan of every Python object.
+    '''
+    def __init__(self):
+        self._tensors = {}
+
+    def track(self, name, tensor):
+        self._tensors[name] = weakref.ref(tensor)
+        return tensor
+
+    def untrack(self, name):
+        self._tensors.pop(name, None)
+
+    def tensors(self):
+        '''
+            {name: tensor} of the registered tensors still alive.
+        '''
+        alive = {}
+        for name, ref in list(self._tensors.items()):
+            tensor = ref()
+            if tensor is None:
+                del self._tensors[name]
+            else:
+                alive[name] = tensor
+        return alive
+
+    def report(self):
+        return {
+            name: {
+                "shape": list(tensor.shape),
+                "dtype": str(tensor.dtype),
+                "device": str(tensor.device),
+                "bytes": tensor.untyped_storage().nbytes(),
+            }
+            for name, tensor in self.tensors().items()
+        }
+
+    def free(self):
+        '''
+            Releases the storage of every registered tensor that is still
+            alive, returns the bytes released. Their tensors must not be
+            used anymore.
+        '''
+        released = 0
+        for name, tensor in self.tensors().items():
+            released += tensor.untyped_storage().nbytes()
+            tensor.grad = None
+            tensor.untyped_storage().resize_(0)
+            self.untrack(name)
+
+        return released
+
+tensors = TensorRegistry()
+
+class MemoryTracker:
+    '''
+        Memory of named phases (e.g. forward, backward, optimizer): at
+        the end of a phase allocated / reserved GPU memory and host RSS,
+        and the peaks of each during it, the highest ones since reset().
+        Reading the allocator's statistics does not wait for the GPU. On
+        CPU only host memory is tracked.
+
+        An out of memory error inside a phase writes to dump_dir before it
+        is raised again, once, by the innermost phase:
+            oom_rank_{rank}.json: the phase, the statistics of every phase,
+                the allocator summary and the registered tensors (tensors)
+            oom_rank_{rank}.pickle: the allocator snapshot with the stack
+                of every allocation, for pytorch.org/memory_viz (CUDA only,
+                record_history=True, which records a stack trace for every
+                allocation of the run and slows them down)
+
+        tracker = MemoryTracker(dump_dir=run_path / "memory")
+        with tracker.phase("forward"):
+            loss = model(batch)
+    '''
+    def __init__(self, dump_dir=None, device=None, record_history=False, max_entries=100000):
+        if device is None:
+            device = torch.device("cuda", torch.cuda.current_device()) if torch.cuda.is_available() else torch.device("cpu")
+
+        self.device   = torch.device(device)
+        self.cuda     = self.device.type == "cuda"
+        self.dump_dir = Path(dump_dir) if dump_dir else None
+        self.rank     = int(os.environ.get("RANK", 0))
+        self.stats    = {}
+        self._stack   = []
+
+        if self.cuda and record_history:
+            torch.cuda.memory._record_memory_history(max_entries=max_entries)
+
+    def _peaks(self):
+        _, peak_rss = host_memory()
+        if not self.cuda:
+            return 0, 0, peak_rss
+
+        return (
+            torch.cuda.max_memory_allocated(self.device),
+            torch.cuda.max_memory_reserved(self.device),
+            peak_rss,
+        )
+
+    def _reset_peaks(self):
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        reset_host_peak()
+
+    def _fold(self, name, peaks):
+        stats = self.stats.setdefault(name, {
+            "peak_allocated": 0,
+            "peak_reserved": 0,
+            "peak_rss": 0,
+        })
+        stats["peak_allocated"] = max(stats["peak_allocated"], peaks[0])
+        stats["peak_reserved"]  = max(stats["peak_reserved"], peaks[1])
+        stats["peak_rss"]       = max(stats["peak_rss"], peaks[2])
+        return stats
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # the peaks so far belong to the enclosing phases
+        peaks = self._peaks()
+        for outer in self._stack:
+            self._fold(outer, peaks)
+
+        self._reset_peaks()
+        self._stack.append(name)
+
+        try:
+            yield
+        except Exception as error:
+            # enclosing phases see the same error
+            if is_out_of_memory(error) and not getattr(error, "_higgsfield_dumped", False):
+                error._higgsfield_dumped = True
+                self.dump(name, error)
+            raise
+        finally:
+            self._stack.pop()
+
+            peaks = self._peaks()
+            for phase in self._stack + [name]:
+                self._fold(phase, peaks)
+
+            stats = self.stats[name]
+            stats["allocated"] = torch.cuda.memory_allocated(self.device) if self.cuda else 0
+            stats["reserved"]  = torch.cuda.memory_reserved(self.device) if self.cuda else 0
+            stats["rss"]       = host_memory()[0]
+
+    def reset(self):
+        self.stats = {}
+
+    def metrics(self):
+        '''
+            Flat {memory/{phase}_{stat}_gb: value} of every phase, e.g. for
+            wandb.log, only host memory on CPU.
+        '''
+        return {
+            f"memory/{phase}_{key}_gb": value / GiB
+            for phase, stats in self.stats.items()
+            for key, value in stats.items()
+            if self.cuda or "rss" in key
+        }
+
+    def summary(self):
+        lines = [f"{'phase':12} {'alloc GiB':>10} {'peak':>8} {'reserved':>9} {'peak':>8} {'rss GiB':>8} {'peak':>8}"]
+        for phase, stats in self.stats.items():
+            lines.append(
+                f"{phase:12} {stats.get('allocated', 0) / GiB:10.2f} {stats['peak_allocated'] / GiB:8.2f} "
+                f"{stats.get('reserved', 0) / GiB:9.2f} {stats['peak_reserved'] / GiB:8.2f} "
+                f"{stats.get('rss', 0) / GiB:8.2f} {stats['peak_rss'] / GiB:8.2f}"
+            )
+        return "\n".join(lines)
+
+    def dump(self, phase, error=None):
+        '''
+            Writes the out of memory forensics of phase to dump_dir, returns
+            the paths written.
+        '''
+        if self.dump_dir is None:
+            return []
+
+        self.dump_dir.mkdir(parents=True, exist_ok=True)
+        written = []
+
+        report = {
+            "rank": self.rank,
+            "phase": phase,
+            "error": str(error) if error else None,
+            "stats": self.stats,
+            "host_rss": host_memory()[0],
+            "tracked_tensors": tensors.report(),
+        }
+        if self.cuda:
+            report["allocator"] = torch.cuda.memory_summary(self.device)
+
+            snapshot = self.dump_dir / f"oom_rank_{self.rank}.pickle"
+            torch.cuda.memory._dump_snapshot(str(snapshot))
+            written.append(snapshot)
+
+        path = self.dump_dir / f"oom_rank_{self.rank}.json"
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        written.append(path)
+
+        print(f"Rank {self.rank} ran out of memory in {phase}, see {', '.join(map(str, written))}")
+
+        return written
+
+def empty_cache():
+    '''
+        Frees the registered tensors (tensors.free()) and returns the
+        cached blocks of the allocator to the GPU.
+    '''
+    tensors.free()
+    gc.collect()
+
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()